@@ -1,15 +1,32 @@
 """
-Batched Assessment Engine - DeepSeek V3 with 5-batch processing
-Processes 44 measures in 5 batches (8-10 measures per batch) for comprehensive detail
+Batched Assessment Engine - DeepSeek V3 with batched processing
+Processes 44 measures in token-budgeted batches (typically 5 calls of 8-9 measures)
+for comprehensive detail
 """
 import os
 import json
 import re
+import math
+import time
 import logging
-from typing import Dict, List, Tuple
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from openai import OpenAI
-from app.brave_search import search_company_climate_info
-from app.database import Database
+from app.brave_search import AdaptiveDocumentSearch
+from app.search_cache import get_search_cache
+from app.brave_quota import get_brave_quota
+from app.http_client import get_http_client
+from app.database import Database, STAGE_ASSESSMENT
+from app.llm_cache import LLMResponseCache, make_cache_key
+from app.stream_parser import MeasureStreamParser
+from app.batch_planner import BatchPlanner, count_tokens
+from app.evidence_selector import EvidenceSelector
+from app.retry_policy import RetryPolicies, classify_error, get_circuit_breaker
+from app.processprompt_index import (
+    build_section_index, is_usable, match_measure_names, render_shared, render_measures
+)
 from app.document_extraction_v3 import extract_documents_for_company
 from app.document_extraction_simple import format_documents_for_assessment
 from app.sustainability_portal import get_priority_documents
@@ -17,6 +34,10 @@ from app.sustainability_portal import get_priority_documents
 
 logger = logging.getLogger(__name__)
 
+DEEPSEEK_MODEL = "deepseek-chat"
+
+SYSTEM_MESSAGE = "You are an expert climate risk analyst. Provide comprehensive, evidence-based assessments with detailed multi-paragraph rationale, specific verbatim evidence quotes, and source URLs for each measure."
+
 # Define measure batches (44 measures split into 5 batches)
 MEASURE_BATCHES = [
     # Batch 1: Governance & Strategic Oversight (M01-M09) - 9 measures
@@ -35,6 +56,14 @@ MEASURE_BATCHES = [
     ["M38", "M39", "M40", "M41", "M42", "M43", "M44"]
 ]
 
+# Valid values in model output (anything else is re-requested)
+MIN_SCORE = 0
+MAX_SCORE = 4
+CONFIDENCE_LEVELS = ('Low', 'Medium', 'High', 'Unknown')
+
+# All measures in output order (input to the dynamic batch planner)
+ALL_MEASURE_IDS = [measure_id for batch in MEASURE_BATCHES for measure_id in batch]
+
 MEASURE_NAMES = {
     "M01": "Board Oversight of Physical Climate Risk",
     "M02": "Senior Management Responsibility for Physical Climate Risk",
@@ -82,6 +111,18 @@ MEASURE_NAMES = {
     "M44": "Long-term Value Creation and Sustainability"
 }
 
+class LeaseLostError(Exception):
+    """The job's lease expired and it was handed to another worker"""
+
+
+class JobRetryScheduled(Exception):
+    """The job failed transiently and was requeued to run again later"""
+
+
+class JobInterrupted(Exception):
+    """The worker is shutting down; finished measures were checkpointed and the job released"""
+
+
 class BatchedAssessmentEngine:
     """Batched assessment engine using DeepSeek V3"""
     
@@ -90,40 +131,268 @@ class BatchedAssessmentEngine:
         self.deepseek_client = None
         self.ai_model_name = "DeepSeek V3"
         
+        # Max number of batch calls in flight per company (1 = sequential)
+        self.batch_concurrency = max(1, int(os.getenv('BATCH_CONCURRENCY', len(MEASURE_BATCHES))))
+        
+        # Prompt layout: 'prefix_cache' (shared context first) or 'legacy' (batch header first)
+        self.prompt_layout = os.getenv('PROMPT_LAYOUT', 'prefix_cache')
+        
+        # Persistent response cache for deterministic re-runs
+        self.llm_cache = LLMResponseCache(self.db)
+        
+        # Stream completions and save each measure as soon as it is parsed
+        self.stream_responses = os.getenv('LLM_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+        
+        # Set on worker shutdown: in-flight streams are cut off and no new calls start
+        self.stop_event = threading.Event()
+        
+        # Job-level retries for transient failures (429s, timeouts, 5xx)
+        self.retry_policies = RetryPolicies()
+        
+        # Follow-up calls for measures missing/invalid in a batch response
+        self.repair_attempts = max(0, int(os.getenv('REPAIR_MAX_ATTEMPTS', '2')))
+        
+        # Batch planning: 'dynamic' (token-budgeted) or 'fixed' (MEASURE_BATCHES, 8000 max_tokens)
+        self.batch_planning = os.getenv('BATCH_PLANNING', 'dynamic')
+        self.batch_planner = BatchPlanner()
+        
+        # Evidence per call: 'per_batch' (top sources for the batch's measures) or 'all'
+        self.evidence_selection = os.getenv('EVIDENCE_SELECTION', 'per_batch')
+        self.evidence_selector = EvidenceSelector(MEASURE_NAMES)
+        
+        # ProcessPrompt in prompts: 'truncated' (first 40,000 characters of the full document)
+        # or 'indexed' (shared sections + batch's measure definitions; only used when the
+        # ProcessPrompt defines every measure under the same ID and name as MEASURE_NAMES)
+        self.processprompt_mode = os.getenv('PROCESSPROMPT_MODE', 'truncated')
+        
         # Initialize DeepSeek V3 client
         deepseek_key = os.getenv('DEEPSEEK_API_KEY')
         if not deepseek_key:
             raise ValueError("DEEPSEEK_API_KEY environment variable not set")
         
+        # Own timeout: the shared client's 30s default is far too short for long completions
+        # (DEEPSEEK_TIMEOUT seconds, the OpenAI SDK's default; connect uses HTTP_CONNECT_TIMEOUT)
         self.deepseek_client = OpenAI(
             api_key=deepseek_key,
-            base_url="https://api.deepseek.com"
+            base_url="https://api.deepseek.com",
+            http_client=get_http_client(),
+            timeout=httpx.Timeout(
+                float(os.getenv('DEEPSEEK_TIMEOUT', '600')),
+                connect=float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+            ),
+            # Retries are the job's retry policies and the circuit breaker, not the SDK's
+            max_retries=0
         )
         logger.info("Batched Assessment Engine initialized with DeepSeek V3")
     
-    def call_deepseek(self, prompt: str, max_tokens: int = 8000) -> str:
-        """Call DeepSeek V3 API"""
+    def call_deepseek(self, prompt: str, max_tokens: int = 8000, use_cache: bool = True,
+                      stream_parser: Optional[MeasureStreamParser] = None,
+                      job_id: Optional[int] = None, batch_num: Optional[int] = None) -> str:
+        """
+        Call DeepSeek V3 API (served from the response cache when possible)
+        
+        If stream_parser is given, the completion is streamed and fed to the parser
+        as it arrives; the stream is cut off as soon as the parser flags it malformed.
+        If job_id is given, tokens, latency and finish_reason are recorded in job_metrics.
+        """
+        started = time.time()
+        cache_key = make_cache_key(DEEPSEEK_MODEL, SYSTEM_MESSAGE, prompt, max_tokens)
+        if use_cache:
+            cached = self.llm_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"DeepSeek response served from cache ({cache_key[:12]})")
+                if stream_parser is not None:
+                    stream_parser.feed(cached)
+                self._record_metric(job_id, 'llm', batch_num=batch_num,
+                                    latency_ms=self._elapsed_ms(started), finish_reason='response_cache')
+                return cached
+        
+        breaker = get_circuit_breaker('deepseek')
+        breaker.before_call()
         try:
-            response = self.deepseek_client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "You are an expert climate risk analyst. Provide comprehensive, evidence-based assessments with detailed multi-paragraph rationale, specific verbatim evidence quotes, and source URLs for each measure."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens,
-                temperature=0  # Maximum determinism for repeatability
-            )
-            
-            return response.choices[0].message.content
+            if stream_parser is not None:
+                content, finish_reason, usage = self._stream_deepseek(prompt, max_tokens, stream_parser)
+            else:
+                response = self.deepseek_client.chat.completions.create(
+                    model=DEEPSEEK_MODEL,
+                    messages=self._build_messages(prompt),
+                    max_tokens=max_tokens,
+                    temperature=0  # Maximum determinism for repeatability
+                )
+                
+                content = response.choices[0].message.content
+                finish_reason = response.choices[0].finish_reason
+                usage = response.usage
             
         except Exception as e:
             logger.error(f"DeepSeek API call failed: {e}")
+            breaker.record_failure(e)
+            self._record_metric(job_id, 'llm', batch_num=batch_num,
+                                latency_ms=self._elapsed_ms(started), finish_reason='error')
             raise
+        
+        breaker.record_success()
+        self._log_usage(usage)
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        completion_tokens = getattr(usage, 'completion_tokens', None)
+        if usage is None and stream_parser is not None:
+            # Stream cut off before its final usage chunk - the call is still billed, so estimate
+            prompt_tokens = count_tokens(SYSTEM_MESSAGE) + count_tokens(prompt)
+            completion_tokens = count_tokens(content)
+        self._record_metric(
+            job_id, 'llm', batch_num=batch_num,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=self._cache_hit_tokens(usage),
+            latency_ms=self._elapsed_ms(started),
+            finish_reason=finish_reason
+        )
+        
+        # Only cache complete responses - truncated output should be retried
+        if use_cache and content and finish_reason == 'stop':
+            self.llm_cache.set(cache_key, DEEPSEEK_MODEL, content)
+        
+        return content
+    
+    def _stream_deepseek(self, prompt: str, max_tokens: int,
+                         stream_parser: MeasureStreamParser) -> Tuple[str, Optional[str], object]:
+        """Stream a completion into stream_parser; returns (content, finish_reason, usage)"""
+        stream = self.deepseek_client.chat.completions.create(
+            model=DEEPSEEK_MODEL,
+            messages=self._build_messages(prompt),
+            max_tokens=max_tokens,
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        
+        parts = []
+        finish_reason = None
+        usage = None
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                
+                choice = chunk.choices[0]
+                delta = choice.delta.content if choice.delta else None
+                if delta:
+                    parts.append(delta)
+                    stream_parser.feed(delta)
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                
+                if self.stop_event.is_set():
+                    logger.warning("Cutting off DeepSeek stream: worker shutting down")
+                    finish_reason = 'interrupted'
+                    break
+                
+                if stream_parser.malformed:
+                    # Don't burn the rest of the token budget on unusable output
+                    logger.warning(f"Cutting off malformed DeepSeek stream: {stream_parser.error}")
+                    finish_reason = 'malformed'
+                    break
+        finally:
+            stream.close()
+        
+        return "".join(parts), finish_reason, usage
+    
+    def _build_messages(self, prompt: str) -> List[Dict]:
+        """Build chat messages for a DeepSeek call"""
+        return [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _log_usage(self, usage):
+        """Log prompt/completion tokens and DeepSeek context-cache hit/miss tokens"""
+        if usage is None:
+            return
+        
+        # DeepSeek-specific usage fields (absent on other providers)
+        cache_hit = getattr(usage, 'prompt_cache_hit_tokens', None)
+        cache_miss = getattr(usage, 'prompt_cache_miss_tokens', None)
+        
+        logger.info(f"DeepSeek usage: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, "
+                    f"cache_hit={cache_hit}, cache_miss={cache_miss}")
+    
+    def _cache_hit_tokens(self, usage) -> Optional[int]:
+        """Prompt tokens served from the provider's context cache"""
+        if usage is None:
+            return None
+        cache_hit = getattr(usage, 'prompt_cache_hit_tokens', None)
+        if cache_hit is None:
+            details = getattr(usage, 'prompt_tokens_details', None)
+            cache_hit = getattr(details, 'cached_tokens', None)
+        return cache_hit
+    
+    def _elapsed_ms(self, started: float) -> int:
+        return int((time.time() - started) * 1000)
+    
+    def _record_metric(self, job_id: Optional[int], stage: str, **fields):
+        """Write a job_metrics row (telemetry failures never fail the job)"""
+        if job_id is None:
+            return
+        try:
+            self.db.record_job_metric(job_id, stage, **fields)
+        except Exception as e:
+            logger.warning(f"Failed to record {stage} metric for job {job_id}: {e}")
+    
+    def _fail_or_retry(self, job_id: int, claim_token: str, error: Exception, error_msg: str, attempt: int):
+        """Requeue the job with backoff if the error class allows another attempt, otherwise fail it"""
+        delay = self.retry_policies.retry_delay(error, attempt)
+        if delay is None:
+            if not self.db.update_job_status(job_id, 'failed', error_message=error_msg, claim_token=claim_token):
+                raise LeaseLostError(f"Lease for job {job_id} expired before it could be failed") from error
+            self._delete_checkpoints(job_id)
+            return
+        
+        refund_attempt = not self.retry_policies.counts_as_attempt(error)
+        if not self.db.requeue_job(job_id, delay, error_message=error_msg, claim_token=claim_token,
+                                   refund_attempt=refund_attempt):
+            raise LeaseLostError(f"Lease for job {job_id} expired before it could be requeued") from error
+        raise JobRetryScheduled(
+            f"{classify_error(error)} on attempt {attempt}, retrying in {delay:.0f}s: {error}"
+        ) from error
+    
+    def _load_checkpoints(self, job_id: int) -> Dict[str, Dict]:
+        """Stages completed by earlier attempts of this job (empty if none or unreadable)"""
+        try:
+            return self.db.get_job_checkpoints(job_id)
+        except Exception as e:
+            logger.warning(f"Failed to load checkpoints for job {job_id}: {e}")
+            return {}
+    
+    def _save_checkpoint(self, job_id: int, stage: str, data: Dict, merge: bool = False):
+        """Persist a completed stage (checkpoint failures never fail the job)"""
+        try:
+            self.db.save_job_checkpoint(job_id, stage, data, merge=merge)
+        except Exception as e:
+            logger.warning(f"Failed to save '{stage}' checkpoint for job {job_id}: {e}")
+    
+    def _delete_checkpoints(self, job_id: int):
+        try:
+            self.db.delete_job_checkpoints(job_id)
+        except Exception as e:
+            logger.warning(f"Failed to delete checkpoints for job {job_id}: {e}")
+    
+    def _heartbeat(self, job_id: int, claim_token: str):
+        """Extend the job lease between pipeline stages; raise if another worker now owns the job"""
+        try:
+            held = self.db.extend_job_leases({job_id: claim_token})
+        except Exception as e:
+            logger.warning(f"Lease heartbeat failed for job {job_id}: {e}")
+            return
+        if job_id not in held:
+            raise LeaseLostError(f"Lease for job {job_id} expired and the job was requeued")
     
     def process_company(self, job_id: int, company_data: Dict):
-        """Process company with batched assessment (5 API calls)"""
+        """Process company with batched assessment (one API call per planned batch)"""
         company_name = company_data['name']
         isin = company_data['isin']
+        claim_token = company_data['claim_token']
         
         logger.info(f"Starting batched assessment for {company_name} ({isin})")
         
@@ -136,65 +405,84 @@ class BatchedAssessmentEngine:
             processprompt_content = processprompt['content']
             logger.info(f"Using ProcessPrompt: {processprompt['version_name']}")
             
+            # Shared methodology sections go in every batch; measure definitions only in their batch
+            section_index = self._get_section_index(processprompt)
+            methodology = render_shared(section_index) if section_index else processprompt_content
+            
             # Step 2: Document retrieval with relevance ranking
             logger.info(f"Retrieving documents for {company_name}...")
             
-            # 2a: Brave adaptive search (exhaustive)
-            logger.info("[CHECKPOINT 1] Starting Brave adaptive search...")
-            all_search_results = search_company_climate_info(company_name, isin=isin, max_results=150)
-            logger.info(f"[CHECKPOINT 2] Brave adaptive search found {len(all_search_results)} unique documents")
-            
-            # 2b: Sort documents by URL for deterministic ordering
-            logger.info("[CHECKPOINT 3] Sorting documents by URL for deterministic ordering...")
-            # Sort by URL to ensure consistent ordering across runs
-            sorted_documents = sorted(all_search_results, key=lambda x: x.get('url', ''))
-            logger.info(f"[CHECKPOINT 4] Using all {len(sorted_documents)} documents (no ranking/filtering)")
+            # Completed stages from a previous attempt (or the retrieval stage) of this job
+            checkpoints = self._load_checkpoints(job_id)
+            sorted_documents, search_context = self._retrieve(job_id, company_data, checkpoints)
             
-            # 2c: Format all documents for assessment
-            logger.info("[CHECKPOINT 5] Formatting all documents for LLM...")
-            search_context = self._format_search_with_urls(sorted_documents)
-            logger.info(f"[CHECKPOINT 6] Using {len(sorted_documents)} documents for assessment (deterministic)")
+            self._heartbeat(job_id, claim_token)
             
-            # No two-pass retry - use all documents in single pass
-            self._all_documents = sorted_documents
+            # Step 3: Plan batches and build all prompts up front, then run batches concurrently
+            batches = self._plan_batches(company_data, methodology, search_context, section_index)
             
-            # Step 3: Process each batch
-            all_measures = {}
-            for batch_num, measure_ids in enumerate(MEASURE_BATCHES, 1):
-                logger.info(f"Processing batch {batch_num}/5 ({len(measure_ids)} measures)...")
-                
-                batch_prompt = self._build_batch_prompt(
+            def build_prompt(measure_ids: List[str], batch_num: int) -> str:
+                return self._build_batch_prompt(
                     company_data=company_data,
-                    processprompt=processprompt_content,
-                    web_search_results=search_context,
+                    processprompt=methodology,
+                    web_search_results=self._select_evidence(sorted_documents, measure_ids, search_context),
                     measure_ids=measure_ids,
-                    batch_num=batch_num
+                    batch_num=batch_num,
+                    total_batches=len(batches),
+                    measure_definitions=render_measures(section_index, measure_ids) if section_index else None
                 )
-                
-                # Call DeepSeek V3 for this batch
-                batch_response = self.call_deepseek(batch_prompt, max_tokens=8000)
-                
-                # Parse batch results
-                batch_measures = self._parse_batch_response(batch_response, measure_ids)
+            
+            # Measures from a previous attempt are only reused with the same ProcessPrompt
+            measures_stage = f"measures:{processprompt['id']}"
+            resumed_measures = checkpoints.get(measures_stage, {})
+            if resumed_measures:
+                logger.info(f"Resuming with {len(resumed_measures)} measures saved by a previous attempt")
+                # Progress was reset when this attempt claimed the job
+                self._save_partial_measures(job_id, claim_token, resumed_measures)
+            
+            for batch in batches:
+                batch['checkpoint_stage'] = measures_stage
+                batch['claim_token'] = claim_token
+                batch['resumed'] = {
+                    mid: resumed_measures[mid] for mid in batch['measure_ids'] if mid in resumed_measures
+                }
+                pending_ids = [mid for mid in batch['measure_ids'] if mid not in batch['resumed']]
+                batch['prompt'] = build_prompt(measure_ids=pending_ids, batch_num=batch['batch_num']) if pending_ids else None
+            
+            use_cache = not company_data.get('bypass_llm_cache', False)
+            batch_results = self._run_batches(job_id, batches, build_prompt, use_cache=use_cache)
+            
+            # Merge in batch order so output stays deterministic
+            all_measures = {}
+            for batch_measures in batch_results:
                 all_measures.update(batch_measures)
-                
-                logger.info(f"✓ Batch {batch_num}/5 completed ({len(batch_measures)} measures)")
             
             # Step 4: Calculate overall scores (no Pass 2 retry - using all docs in single pass)
             assessment_data = self._build_assessment_data(
                 all_measures=all_measures,
-                company_data=company_data
+                company_data=company_data,
+                num_batches=len(batches)
             )
             
-            # Step 5: Save to database
+            # Step 5: Save to database and complete the job, if this worker still owns it
             logger.info(f"Saving detailed assessment...")
-            self.db.save_assessment(job_id, company_data.get('company_id', 0), assessment_data)
-            
-            # Step 6: Update job status
-            self.db.update_job_status(job_id, 'completed')
+            if not self.db.complete_job(job_id, company_data.get('company_id', 0), assessment_data, claim_token):
+                raise LeaseLostError(f"Lease for job {job_id} expired before the assessment was saved")
+            self._delete_checkpoints(job_id)
             
             logger.info(f"✓ Batched assessment completed for {company_name} (44 measures)")
             
+        except LeaseLostError as e:
+            # Another worker owns the job now - leave its status alone
+            logger.warning(f"Abandoning assessment for {company_name}: {e}")
+            raise
+            
+        except JobInterrupted as e:
+            # Progress is checkpointed; hand the job back so another worker resumes it
+            logger.warning(f"Interrupted assessment for {company_name}: {e}")
+            self.db.release_jobs({job_id: claim_token})
+            raise
+            
         except Exception as e:
             import traceback
             error_trace = traceback.format_exc()
@@ -202,9 +490,278 @@ class BatchedAssessmentEngine:
             logger.error(f"Full traceback:\n{error_trace}")
             # Store both error message and traceback
             error_msg = f"{type(e).__name__}: {str(e)}\n\nTraceback:\n{error_trace[:500]}"
-            self.db.update_job_status(job_id, 'failed', error_message=error_msg)
+            self._fail_or_retry(job_id, claim_token, e, error_msg, company_data.get('attempts', 1))
             raise
     
+    def run_retrieval(self, job_id: int, company_data: Dict):
+        """
+        Retrieval stage only: search, checkpoint the results and hand the job to the assessment stage
+        
+        The 'search' checkpoint is the hand-off - process_company picks it up
+        instead of searching again.
+        """
+        company_name = company_data['name']
+        claim_token = company_data['claim_token']
+        
+        try:
+            self._retrieve(job_id, company_data, self._load_checkpoints(job_id))
+            if not self.db.advance_job_stage(job_id, STAGE_ASSESSMENT, claim_token):
+                raise LeaseLostError(f"Lease for job {job_id} expired before retrieval was handed off")
+            logger.info(f"✓ Retrieval completed for {company_name}, queued for assessment")
+            
+        except LeaseLostError as e:
+            logger.warning(f"Abandoning retrieval for {company_name}: {e}")
+            raise
+            
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            logger.error(f"Retrieval failed for {company_name}: {e}")
+            error_msg = f"{type(e).__name__}: {str(e)}\n\nTraceback:\n{error_trace[:500]}"
+            self._fail_or_retry(job_id, claim_token, e, error_msg, company_data.get('attempts', 1))
+            raise
+    
+    def _retrieve(self, job_id: int, company_data: Dict, checkpoints: Dict) -> Tuple[List[Dict], str]:
+        """Sorted documents and formatted source context, from the 'search' checkpoint or a new search"""
+        if 'search' in checkpoints:
+            logger.info("[CHECKPOINT 1] Resuming from saved search results (no Brave calls)")
+            sorted_documents = checkpoints['search']['documents']
+            search_context = checkpoints['search']['search_context']
+            logger.info(f"[CHECKPOINT 6] Using {len(sorted_documents)} saved documents for assessment")
+            return sorted_documents, search_context
+        
+        # 2a: Brave adaptive search (exhaustive)
+        logger.info("[CHECKPOINT 1] Starting Brave adaptive search...")
+        search_started = time.time()
+        searcher = AdaptiveDocumentSearch(max_documents=150, cache=get_search_cache(self.db),
+                                          quota=get_brave_quota(self.db))
+        all_search_results = searcher.search(company_data['name'], company_data['isin'], verbose=False)
+        self._record_metric(job_id, 'search', latency_ms=self._elapsed_ms(search_started),
+                            query_count=searcher.search_count, search_cache_hits=searcher.cache_hits,
+                            queries_saved=searcher.queries_saved, finish_reason=searcher.stop_reason)
+        logger.info(f"[CHECKPOINT 2] Brave adaptive search found {len(all_search_results)} unique documents "
+                    f"({searcher.search_count} Brave queries, {searcher.cache_hits} served from cache, "
+                    f"{searcher.near_duplicates_removed} near-duplicates merged)")
+        
+        # 2b: Sort documents by URL for deterministic ordering
+        logger.info("[CHECKPOINT 3] Sorting documents by URL for deterministic ordering...")
+        # Sort by URL to ensure consistent ordering across runs
+        sorted_documents = sorted(all_search_results, key=lambda x: x.get('url', ''))
+        logger.info(f"[CHECKPOINT 4] Using all {len(sorted_documents)} documents (no ranking/filtering)")
+        
+        # 2c: Format all documents for assessment
+        logger.info("[CHECKPOINT 5] Formatting all documents for LLM...")
+        search_context = self._format_search_with_urls(sorted_documents)
+        logger.info(f"[CHECKPOINT 6] Using {len(sorted_documents)} documents for assessment (deterministic)")
+        
+        self._save_checkpoint(job_id, 'search', {
+            'documents': sorted_documents,
+            'search_context': search_context
+        })
+        return sorted_documents, search_context
+    
+    def _get_section_index(self, processprompt: Dict) -> Optional[Dict]:
+        """Section index for the active ProcessPrompt, or None to use the truncated full text"""
+        if self.processprompt_mode != 'indexed':
+            return None
+        
+        section_index = processprompt.get('section_index')
+        if not is_usable(section_index):
+            # Stored before indexing existed, or by an older index version - index in memory
+            section_index = build_section_index(processprompt['content'])
+        
+        if not is_usable(section_index):
+            logger.warning("ProcessPrompt has no per-measure definitions; using truncated full text")
+            return None
+        
+        # Never inject a definition for a different measure than the one being scored, and
+        # don't trade the full methodology for an index that leaves measures undefined
+        section_index = match_measure_names(section_index, MEASURE_NAMES)
+        undefined = [mid for mid in ALL_MEASURE_IDS if mid not in section_index['measures']]
+        if undefined:
+            logger.warning(f"ProcessPrompt index has no matching definition for {len(undefined)} of "
+                           f"{len(ALL_MEASURE_IDS)} measures; using truncated full text")
+            return None
+        
+        return section_index
+    
+    def _plan_batches(self, company_data: Dict, processprompt: str, web_search_results: str,
+                      section_index: Optional[Dict] = None) -> List[Dict]:
+        """
+        Decide how measures are split into calls for this company
+        
+        Returns:
+            List of {'batch_num', 'measure_ids', 'max_tokens'} in output order
+        """
+        if self.batch_planning == 'fixed':
+            return [
+                {'batch_num': batch_num, 'measure_ids': measure_ids, 'max_tokens': 8000}
+                for batch_num, measure_ids in enumerate(MEASURE_BATCHES, 1)
+            ]
+        
+        if self.evidence_selection == 'per_batch':
+            # Sources are selected per batch, up to the evidence budget
+            shared_tokens = (count_tokens(self._build_shared_context(company_data, processprompt))
+                             + self.evidence_selector.token_budget)
+        else:
+            shared_tokens = count_tokens(self._build_shared_context(company_data, processprompt, web_search_results))
+        task_overhead = count_tokens(self._build_batch_task(company_data, ALL_MEASURE_IDS[:1]))
+        
+        # Per-measure prompt cost: measure list line, plus its ProcessPrompt definition if indexed
+        definition_tokens = {
+            measure_id: count_tokens(render_measures(section_index, [measure_id])) if section_index else 0
+            for measure_id in ALL_MEASURE_IDS
+        }
+        list_tokens = self.batch_planner.prompt_tokens_per_measure
+        avg_definition_tokens = math.ceil(sum(definition_tokens.values()) / len(ALL_MEASURE_IDS))
+        
+        planned = self.batch_planner.plan(ALL_MEASURE_IDS, shared_tokens, task_overhead,
+                                          prompt_tokens_per_measure=list_tokens + avg_definition_tokens)
+        return [
+            {
+                'batch_num': batch_num,
+                'measure_ids': measure_ids,
+                'max_tokens': self.batch_planner.max_tokens_for(
+                    shared_tokens + task_overhead
+                    + sum(list_tokens + definition_tokens[mid] for mid in measure_ids)
+                )
+            }
+            for batch_num, measure_ids in enumerate(planned, 1)
+        ]
+    
+    def _select_evidence(self, documents: List[Dict], measure_ids: List[str], all_sources: str) -> str:
+        """Formatted sources for a batch: all of them, or the top ones for its measures"""
+        if self.evidence_selection != 'per_batch':
+            return all_sources
+        
+        selected = self.evidence_selector.select(
+            documents, measure_ids,
+            cost_fn=lambda doc: count_tokens(self._format_search_with_urls([doc]))
+        )
+        return self._format_search_with_urls(selected)
+    
+    def _run_batch(self, job_id: int, batch: Dict, total_batches: int,
+                   build_prompt, use_cache: bool = True) -> Dict:
+        """
+        Call DeepSeek V3 for a single batch and parse its measures
+        
+        Measures that are missing or invalid in the response are re-requested on
+        their own (build_prompt with just those IDs, proportionally smaller
+        max_tokens), up to repair_attempts times.
+        """
+        batch_num = batch['batch_num']
+        measure_ids = batch['measure_ids']
+        label = f"Batch {batch_num}/{total_batches}"
+        
+        # Measures already completed by a previous attempt of this job
+        resumed = batch.get('resumed', {})
+        pending_ids = [mid for mid in measure_ids if mid not in resumed]
+        if not pending_ids:
+            logger.info(f"✓ {label} restored from checkpoint ({len(measure_ids)} measures)")
+            return {measure_id: resumed[measure_id] for measure_id in measure_ids}
+        
+        max_tokens = batch['max_tokens']
+        if resumed:
+            max_tokens = max(1000, math.ceil(max_tokens * len(pending_ids) / len(measure_ids)))
+            logger.info(f"{label}: {len(resumed)} measures restored from checkpoint")
+        measure_ids = pending_ids
+        if self.stop_event.is_set():
+            raise JobInterrupted(f"{label} not started: worker shutting down")
+        logger.info(f"Processing {label.lower()} ({len(measure_ids)} measures)...")
+        
+        batch_measures, failures = self._request_measures(
+            job_id, batch['claim_token'], batch_num, batch['prompt'], measure_ids,
+            max_tokens=max_tokens, use_cache=use_cache
+        )
+        
+        attempt = 0
+        while failures and attempt < self.repair_attempts and not self.stop_event.is_set():
+            attempt += 1
+            repair_ids = [mid for mid in measure_ids if mid in failures]
+            repair_tokens = max(1000, math.ceil(max_tokens * len(repair_ids) / len(measure_ids)))
+            logger.info(f"{label} repair {attempt}/{self.repair_attempts}: "
+                        f"re-requesting {', '.join(repair_ids)} (max_tokens={repair_tokens})")
+            
+            repaired, failures = self._request_measures(
+                job_id, batch['claim_token'], batch_num, build_prompt(measure_ids=repair_ids, batch_num=batch_num),
+                repair_ids, max_tokens=repair_tokens, use_cache=use_cache
+            )
+            batch_measures.update(repaired)
+        
+        # Checkpoint valid measures only, so a retried job re-asks the failed ones
+        if batch_measures and batch.get('checkpoint_stage'):
+            self._save_checkpoint(job_id, batch['checkpoint_stage'], batch_measures, merge=True)
+        
+        if failures and self.stop_event.is_set():
+            raise JobInterrupted(f"{label} interrupted with {len(batch_measures)}/{len(measure_ids)} "
+                                 f"measures checkpointed")
+        
+        if failures:
+            logger.warning(f"{label}: no valid assessment for {', '.join(sorted(failures))}")
+        for measure_id, reason in failures.items():
+            batch_measures[measure_id] = self._default_measure(reason)
+        
+        batch_measures.update(resumed)
+        logger.info(f"✓ {label} completed ({len(batch_measures)} measures)")
+        self._heartbeat(job_id, batch['claim_token'])
+        # Keep batch order regardless of repair order
+        return {measure_id: batch_measures[measure_id] for measure_id in batch['measure_ids']}
+    
+    def _request_measures(self, job_id: int, claim_token: str, batch_num: int, prompt: str,
+                          measure_ids: List[str], max_tokens: int, use_cache: bool = True) -> Tuple[Dict, Dict]:
+        """
+        Make one DeepSeek call for measure_ids
+        
+        Returns:
+            (valid measures, {measure_id: failure reason} for missing/invalid ones)
+        """
+        if self.stream_responses:
+            stream_parser = MeasureStreamParser(
+                measure_ids,
+                on_measure=lambda measure_id, measure: self._save_partial_measure(job_id, claim_token, measure_id, measure)
+            )
+            response_text = self.call_deepseek(prompt, max_tokens=max_tokens, use_cache=use_cache,
+                                               stream_parser=stream_parser, job_id=job_id, batch_num=batch_num)
+            # Use streamed measures directly; a cut-off stream is not valid JSON as a whole
+            return self._parse_batch_measures(response_text, measure_ids,
+                                              measures_data=stream_parser.measures or None)
+        
+        response_text = self.call_deepseek(prompt, max_tokens=max_tokens, use_cache=use_cache,
+                                           job_id=job_id, batch_num=batch_num)
+        return self._parse_batch_measures(response_text, measure_ids)
+    
+    def _run_batches(self, job_id: int, batches: List[Dict], build_prompt,
+                     use_cache: bool = True) -> List[Dict]:
+        """
+        Run all batches with up to batch_concurrency calls in flight
+        
+        Returns:
+            List of parsed batch measures, in batch order
+        """
+        with ThreadPoolExecutor(max_workers=self.batch_concurrency) as executor:
+            futures = [
+                executor.submit(self._run_batch, job_id, batch, len(batches), build_prompt, use_cache)
+                for batch in batches
+            ]
+            # result() re-raises the first batch failure, failing the job as before
+            return [future.result() for future in futures]
+    
+    def _save_partial_measure(self, job_id: int, claim_token: str, measure_id: str, measure: Dict):
+        """Persist a single streamed measure as partial job progress"""
+        try:
+            formatted = self._format_measure(measure)
+        except (TypeError, ValueError):
+            return  # Invalid measures are re-requested by the repair loop
+        
+        self._save_partial_measures(job_id, claim_token, {measure_id: formatted})
+    
+    def _save_partial_measures(self, job_id: int, claim_token: str, measures: Dict):
+        """Merge formatted measures into partial job progress (failures never fail the job)"""
+        try:
+            self.db.save_partial_measures(job_id, measures, claim_token)
+        except Exception as e:
+            logger.warning(f"Failed to save partial measures {', '.join(measures)} for job {job_id}: {e}")
+    
     def _format_search_with_urls(self, search_results: List[Dict]) -> str:
         """Format search results with URLs preserved"""
         formatted = []
@@ -212,14 +769,53 @@ class BatchedAssessmentEngine:
             formatted.append(f"""[Source {i}]
 Title: {result.get('title', 'N/A')}
 URL: {result.get('url', 'N/A')}
-Snippet: {result.get('snippet', 'N/A')}
+Snippet: {result.get('snippet') or result.get('description') or 'N/A'}
 """)
         return "\n".join(formatted)
     
     def _build_batch_prompt(self, company_data: Dict, processprompt: str,
                            web_search_results: str, measure_ids: List[str],
-                           batch_num: int) -> str:
-        """Build prompt for a specific batch of measures"""
+                           batch_num: int, total_batches: int = len(MEASURE_BATCHES),
+                           measure_definitions: Optional[str] = None) -> str:
+        """
+        Build prompt for a specific batch of measures
+        
+        In 'prefix_cache' layout the large static block (ProcessPrompt, company,
+        sources) comes first and is byte-identical across all batches of a company,
+        so DeepSeek context caching can reuse it. Batch-specific text goes last:
+        the batch's measure definitions, its sources (with per-batch evidence
+        selection) and the task.
+        """
+        batch_parts = []
+        if measure_definitions:
+            batch_parts.append(f"""## MEASURE DEFINITIONS (ProcessPrompt v2.2)
+{measure_definitions}
+""")
+        
+        if self.prompt_layout == 'legacy':
+            shared_context = self._build_shared_context(company_data, processprompt, web_search_results)
+            batch_parts.append(self._build_batch_task(company_data, measure_ids))
+            return (f"# Physical Climate Risk Assessment - Batch {batch_num}/{total_batches}\n\n"
+                    f"{shared_context}\n" + "\n".join(batch_parts))
+        
+        if self.evidence_selection == 'per_batch':
+            shared_context = self._build_shared_context(company_data, processprompt)
+            batch_parts.append(self._build_sources_block(web_search_results))
+        else:
+            shared_context = self._build_shared_context(company_data, processprompt, web_search_results)
+        
+        batch_parts.append(self._build_batch_task(company_data, measure_ids))
+        return f"{shared_context}\n---\n\n# Batch {batch_num}/{total_batches}\n\n" + "\n".join(batch_parts)
+    
+    def _build_sources_block(self, web_search_results: str) -> str:
+        """Build the web search results section"""
+        return f"""## WEB SEARCH RESULTS (Company-Specific Climate Information)
+{web_search_results}
+"""
+    
+    def _build_shared_context(self, company_data: Dict, processprompt: str,
+                              web_search_results: Optional[str] = None) -> str:
+        """Build the batch-independent part of the prompt (sources omitted if None)"""
         
         company_name = company_data['name']
         isin = company_data['isin']
@@ -227,21 +823,13 @@ Snippet: {result.get('snippet', 'N/A')}
         industry = company_data.get('industry', 'Unknown')
         country = company_data.get('country', 'Unknown')
         
-        # Build measure list for this batch
-        measures_list = "\n".join([
-            f"- **{mid}**: {MEASURE_NAMES[mid]}" 
-            for mid in measure_ids
-        ])
-        
         # Truncate ProcessPrompt if needed
         if len(processprompt) > 40000:
             processprompt_summary = processprompt[:40000] + "\n\n[ProcessPrompt truncated]"
         else:
             processprompt_summary = processprompt
         
-        prompt = f"""# Physical Climate Risk Assessment - Batch {batch_num}/5
-
-**CRITICAL: PHYSICAL CLIMATE RISK EXCLUSIVE FOCUS**
+        focus_block = """**CRITICAL: PHYSICAL CLIMATE RISK EXCLUSIVE FOCUS**
 
 This assessment focuses EXCLUSIVELY on **PHYSICAL CLIMATE RISKS** - the direct impacts of climate change (extreme weather, sea level rise, temperature changes, water stress, etc.).
 
@@ -259,21 +847,42 @@ This assessment focuses EXCLUSIVELY on **PHYSICAL CLIMATE RISKS** - the direct i
 If evidence only mentions "climate risks" or "climate-related risks" WITHOUT specifying PHYSICAL impacts, assign score 0 or "Unknown" with rationale explaining the lack of physical-risk-specific evidence.
 
 ---
-
-## COMPANY INFORMATION
+"""
+        
+        company_block = f"""## COMPANY INFORMATION
 - **Company Name:** {company_name}
 - **ISIN:** {isin}
 - **Sector:** {sector}
 - **Industry:** {industry}
 - **Country:** {country}
-
-## WEB SEARCH RESULTS (Company-Specific Climate Information)
-{web_search_results}
-
-## ASSESSMENT METHODOLOGY (ProcessPrompt v2.2)
+"""
+        
+        sources_block = self._build_sources_block(web_search_results) if web_search_results is not None else ""
+        
+        methodology_block = f"""## ASSESSMENT METHODOLOGY (ProcessPrompt v2.2)
 {processprompt_summary}
-
-## YOUR TASK
+"""
+        
+        if self.prompt_layout == 'legacy':
+            return f"{focus_block}\n{company_block}\n{sources_block}\n{methodology_block}"
+        
+        shared_context = f"# Physical Climate Risk Assessment\n\n{focus_block}\n{methodology_block}\n{company_block}"
+        if sources_block:
+            shared_context += f"\n{sources_block}"
+        return shared_context
+    
+    def _build_batch_task(self, company_data: Dict, measure_ids: List[str]) -> str:
+        """Build the batch-specific task: measure list and output schema"""
+        
+        company_name = company_data['name']
+        
+        # Build measure list for this batch
+        measures_list = "\n".join([
+            f"- **{mid}**: {MEASURE_NAMES[mid]}" 
+            for mid in measure_ids
+        ])
+        
+        return f"""## YOUR TASK
 
 Assess the following {len(measure_ids)} measures for **{company_name}** using the ProcessPrompt v2.2 methodology:
 
@@ -332,69 +941,109 @@ Assess the following {len(measure_ids)} measures for **{company_name}** using th
 - Use verbatim quotes for evidence
 - Provide detailed rationale (2-4 paragraphs minimum per measure)
 - Be realistic - score 0 if no evidence found
+- Scores are whole numbers from 0 to 4 (this scale applies even if the methodology above uses another)
 """
-        
-        return prompt
     
-    def _parse_batch_response(self, response_text: str, measure_ids: List[str]) -> Dict:
-        """Parse batch response and extract measure details"""
+    def _parse_batch_measures(self, response_text: str, measure_ids: List[str],
+                              measures_data: Optional[Dict] = None) -> Tuple[Dict, Dict]:
+        """
+        Parse batch response and extract measure details (measures_data: already-parsed measures)
+        
+        Returns:
+            (valid measures, {measure_id: failure reason} for missing/invalid ones)
+        """
         
         try:
-            # Extract JSON from response
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL)
-            if json_match:
-                response_json = json.loads(json_match.group(1))
-            else:
-                # Try without code blocks
-                json_match = re.search(r'\{.*"measures".*\}', response_text, re.DOTALL)
+            if measures_data is None:
+                # Extract JSON from response
+                json_match = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL)
                 if json_match:
-                    response_json = json.loads(json_match.group(0))
+                    response_json = json.loads(json_match.group(1))
                 else:
-                    raise ValueError("Could not find JSON in response")
-            
-            measures_data = response_json.get('measures', {})
-            batch_measures = {}
-            
-            for measure_id in measure_ids:
-                if measure_id in measures_data:
-                    measure = measures_data[measure_id]
-                    batch_measures[measure_id] = {
-                        'score': int(measure.get('score', 0)),
-                        'confidence': measure.get('confidence', 'Unknown'),
-                        'rationale': measure.get('rationale', 'No rationale provided'),
-                        'evidence': measure.get('evidence', 'No evidence found'),
-                        'source': measure.get('source', ''),
-                        'ai_model': self.ai_model_name
-                    }
-                else:
-                    # Default for missing measure
-                    batch_measures[measure_id] = {
-                        'score': 0,
-                        'confidence': 'Unknown',
-                        'rationale': 'No assessment provided in batch response',
-                        'evidence': 'No evidence found',
-                        'source': '',
-                        'ai_model': self.ai_model_name
-                    }
-            
-            return batch_measures
+                    # Try without code blocks
+                    json_match = re.search(r'\{.*"measures".*\}', response_text, re.DOTALL)
+                    if json_match:
+                        response_json = json.loads(json_match.group(0))
+                    else:
+                        raise ValueError("Could not find JSON in response")
+                
+                measures_data = response_json.get('measures', {})
+                if not isinstance(measures_data, dict):
+                    raise ValueError("'measures' is not an object")
             
         except Exception as e:
             logger.error(f"Failed to parse batch response: {e}")
-            # Return defaults for all measures in batch
-            batch_measures = {}
-            for measure_id in measure_ids:
-                batch_measures[measure_id] = {
-                    'score': 0,
-                    'confidence': 'Unknown',
-                    'rationale': f'Parsing error: {str(e)}',
-                    'evidence': 'No evidence found',
-                    'source': '',
-                    'ai_model': self.ai_model_name
-                }
-            return batch_measures
+            return {}, {measure_id: f'Parsing error: {str(e)}' for measure_id in measure_ids}
+        
+        valid = {}
+        failures = {}
+        for measure_id in measure_ids:
+            if measure_id not in measures_data:
+                failures[measure_id] = 'No assessment provided in batch response'
+                continue
+            try:
+                valid[measure_id] = self._format_measure(measures_data[measure_id])
+            except Exception as e:
+                logger.warning(f"Invalid output for {measure_id}: {e}")
+                failures[measure_id] = f'Parsing error: {str(e)}'
+        
+        return valid, failures
+    
+    def _format_measure(self, measure: Dict) -> Dict:
+        """Normalize a single measure object from the model output (raises if invalid)"""
+        if not isinstance(measure, dict):
+            raise ValueError(f"expected an object, got {type(measure).__name__}")
+        
+        return {
+            'score': self._validate_score(measure.get('score')),
+            'confidence': self._validate_confidence(measure.get('confidence')),
+            'rationale': measure.get('rationale', 'No rationale provided'),
+            'evidence': measure.get('evidence', 'No evidence found'),
+            'source': measure.get('source', ''),
+            'ai_model': self.ai_model_name
+        }
+    
+    def _validate_score(self, score) -> int:
+        """An integer 0-4 (3, 3.0 or "3"); anything else is re-requested by the repair loop"""
+        if isinstance(score, bool) or score is None:
+            raise ValueError(f"missing or non-numeric score: {score!r}")
+        if isinstance(score, str):
+            score = score.strip()
+            if not score.isdigit():
+                raise ValueError(f"non-integer score: {score!r}")
+            score = int(score)
+        elif isinstance(score, float):
+            if not score.is_integer():
+                raise ValueError(f"non-integer score: {score!r}")
+            score = int(score)
+        elif not isinstance(score, int):
+            raise ValueError(f"non-numeric score: {score!r}")
+        
+        if not MIN_SCORE <= score <= MAX_SCORE:
+            raise ValueError(f"score {score} outside {MIN_SCORE}-{MAX_SCORE}")
+        return score
+    
+    def _validate_confidence(self, confidence) -> str:
+        """One of CONFIDENCE_LEVELS (case-insensitive)"""
+        if isinstance(confidence, str):
+            normalized = confidence.strip().capitalize()
+            if normalized in CONFIDENCE_LEVELS:
+                return normalized
+        raise ValueError(f"unknown confidence: {confidence!r}")
+    
+    def _default_measure(self, rationale: str) -> Dict:
+        """Placeholder for a measure with no usable assessment"""
+        return {
+            'score': 0,
+            'confidence': 'Unknown',
+            'rationale': rationale,
+            'evidence': 'No evidence found',
+            'source': '',
+            'ai_model': self.ai_model_name
+        }
     
-    def _build_assessment_data(self, all_measures: Dict, company_data: Dict) -> Dict:
+    def _build_assessment_data(self, all_measures: Dict, company_data: Dict,
+                               num_batches: int = len(MEASURE_BATCHES)) -> Dict:
         """Build final assessment data with all measures"""
         
         # Calculate total score
@@ -418,7 +1067,7 @@ Assess the following {len(measure_ids)} measures for **{company_name}** using th
             'transition_risk_score': 0.0,
             'measures': all_measures,
             'total_measures_assessed': len(all_measures),
-            'assessment_method': 'Batched DeepSeek V3 (5 batches)'
+            'assessment_method': f'Batched DeepSeek V3 ({num_batches} batches)'
         }
 
     def _identify_retry_measures(self, all_measures: Dict) -> List[str]:
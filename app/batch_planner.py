@@ -0,0 +1,108 @@
+"""
+Token-Budget Batch Planner
+Packs measures into the fewest DeepSeek calls that fit the model's context
+window and max output tokens, given the size of the shared evidence context
+"""
+import os
+import math
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Local tokenizer (cl100k_base is close enough to DeepSeek's BPE for budgeting)
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+    logger.warning("tiktoken not available - using character-based token estimates")
+
+# Fallback estimate when tiktoken is missing (conservative for English/markdown)
+CHARS_PER_TOKEN = 3.0
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the local tokenizer (or estimate from length)"""
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+class BatchPlanner:
+    """
+    Plans measure batches from token budgets
+
+    Limits (env-configurable):
+        LLM_CONTEXT_WINDOW          - total tokens per call (prompt + completion)
+        LLM_MAX_OUTPUT_TOKENS       - max completion tokens per call
+        COMPLETION_TOKENS_PER_MEASURE - expected completion tokens per measure
+        PROMPT_TOKENS_PER_MEASURE   - prompt tokens per measure (measure list line)
+        PROMPT_SAFETY_MARGIN        - headroom for tokenizer mismatch
+    """
+
+    def __init__(self):
+        self.context_window = int(os.getenv('LLM_CONTEXT_WINDOW', '65536'))
+        self.max_output_tokens = int(os.getenv('LLM_MAX_OUTPUT_TOKENS', '8000'))
+        self.completion_tokens_per_measure = int(os.getenv('COMPLETION_TOKENS_PER_MEASURE', '800'))
+        self.prompt_tokens_per_measure = int(os.getenv('PROMPT_TOKENS_PER_MEASURE', '25'))
+        self.safety_margin = int(os.getenv('PROMPT_SAFETY_MARGIN', '1024'))
+
+    def max_measures_per_call(self, shared_tokens: int, task_overhead_tokens: int,
+                              prompt_tokens_per_measure: int = None) -> int:
+        """Largest number of measures one call can carry given the shared prompt size"""
+        available = self.context_window - shared_tokens - task_overhead_tokens - self.safety_margin
+        per_measure_total = self.completion_tokens_per_measure + (
+            prompt_tokens_per_measure if prompt_tokens_per_measure is not None else self.prompt_tokens_per_measure
+        )
+
+        by_context = available // per_measure_total
+        by_output = self.max_output_tokens // self.completion_tokens_per_measure
+
+        if by_context < 1:
+            # Splitting cannot help when the shared prefix alone overflows the window
+            logger.warning(f"Shared context ({shared_tokens} tokens) exceeds the context window "
+                           f"({self.context_window}); planning by output budget only")
+            return max(1, by_output)
+
+        return max(1, min(by_context, by_output))
+
+    def plan(self, measure_ids: List[str], shared_tokens: int, task_overhead_tokens: int,
+             prompt_tokens_per_measure: int = None) -> List[List[str]]:
+        """
+        Split measure_ids (kept in order) into the fewest evenly sized batches
+
+        Args:
+            measure_ids: All measures to assess, in output order
+            shared_tokens: Tokens in the batch-independent prompt prefix
+            task_overhead_tokens: Tokens in the batch task excluding the measure list
+            prompt_tokens_per_measure: Override for per-measure prompt tokens
+                (e.g. when measure definitions are included per batch)
+
+        Returns:
+            List of contiguous measure ID batches
+        """
+        per_call = self.max_measures_per_call(shared_tokens, task_overhead_tokens, prompt_tokens_per_measure)
+        num_batches = math.ceil(len(measure_ids) / per_call)
+
+        # Even split: sizes differ by at most one, earlier batches get the extra measure
+        base, extra = divmod(len(measure_ids), num_batches)
+        batches = []
+        start = 0
+        for i in range(num_batches):
+            size = base + (1 if i < extra else 0)
+            batches.append(measure_ids[start:start + size])
+            start += size
+
+        logger.info(f"Batch plan: {len(measure_ids)} measures in {num_batches} calls "
+                    f"(shared context {shared_tokens} tokens, up to {per_call} measures/call)")
+        return batches
+
+    def max_tokens_for(self, prompt_tokens: int) -> int:
+        """Completion budget for a call: the model's output cap, limited by remaining context"""
+        room = self.context_window - prompt_tokens - self.safety_margin
+        return max(1000, min(self.max_output_tokens, room))
@@ -0,0 +1,240 @@
+"""
+Brave Quota Manager
+Token-bucket rate limiting for Brave Search shared by every worker process
+(through Postgres), adapted to the plan limits Brave reports in its
+X-RateLimit-* response headers
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = 'brave'
+
+
+class QuotaWaitError(Exception):
+    """The next Brave slot is further away than we are willing to block a job for"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Brave quota exhausted, next slot in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def _parse_header_values(value: Optional[str]) -> List[int]:
+    """'1, 15000' -> [1, 15000]"""
+    if not value:
+        return []
+    try:
+        return [int(float(part.strip())) for part in value.split(',') if part.strip()]
+    except ValueError:
+        return []
+
+
+def parse_rate_limit_headers(headers) -> Optional[Dict]:
+    """
+    Parse Brave's rate limit headers
+
+    Brave reports one value per window, shortest first, e.g.
+        X-RateLimit-Limit:     1, 15000
+        X-RateLimit-Remaining: 1, 14000
+        X-RateLimit-Reset:     1, 1419704   (seconds until each window resets)
+
+    Returns:
+        Dict with per_second_limit, monthly_remaining and monthly_reset_seconds,
+        or None if the headers are missing
+    """
+    limits = _parse_header_values(headers.get('X-RateLimit-Limit'))
+    remaining = _parse_header_values(headers.get('X-RateLimit-Remaining'))
+    resets = _parse_header_values(headers.get('X-RateLimit-Reset'))
+    if not limits:
+        return None
+
+    return {
+        'per_second_limit': limits[0],
+        'monthly_remaining': remaining[-1] if len(remaining) > 1 else None,
+        'monthly_reset_seconds': resets[-1] if len(resets) > 1 else None,
+        'window_reset_seconds': resets[0] if resets else None
+    }
+
+
+class LocalTokenBucket:
+    """In-process stand-in for the shared bucket (no database, or single worker)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Tuple[bool, float]:
+        """Take a token if one is available within max_wait seconds; returns (granted, wait)"""
+        with self._lock:
+            now = time.monotonic()
+            available = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            wait = max(0.0, (1 - available) / self.rate)
+            granted = wait <= max_wait
+            self.tokens = available - 1 if granted else available
+            self.updated_at = now
+            return granted, wait
+
+    def configure(self, rate: float, capacity: float, quota_remaining: Optional[int]):
+        with self._lock:
+            self.rate = rate
+            self.capacity = capacity
+
+    def pause(self, seconds: float):
+        """No tokens for the next `seconds` (after a 429)"""
+        with self._lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+            self.updated_at = time.monotonic()
+
+
+class PostgresTokenBucket:
+    """Token bucket stored in rate_limit_buckets, shared by every worker process"""
+
+    def __init__(self, db, name: str, rate: float, capacity: float):
+        self.db = db
+        self.name = name
+        self.db.ensure_rate_limit_bucket(name, rate, capacity)
+
+    def reserve(self, max_wait: float) -> Tuple[bool, float]:
+        return self.db.reserve_rate_limit_token(self.name, max_wait)
+
+    def configure(self, rate: float, capacity: float, quota_remaining: Optional[int]):
+        self.db.update_rate_limit_bucket(self.name, rate, capacity, quota_remaining)
+
+    def pause(self, seconds: float):
+        self.db.pause_rate_limit_bucket(self.name, seconds)
+
+
+class BraveQuotaManager:
+    """
+    Paces Brave requests across all workers and adapts to the plan
+
+    Settings (env-configurable):
+        BRAVE_RATE_LIMIT        - requests/second across all workers until headers say otherwise
+        BRAVE_RATE_HEADROOM     - fraction of the reported per-second limit to use
+        BRAVE_QUOTA_LOW         - monthly requests left at which searches are slowed down
+                                  to spread the remainder until the quota resets
+        BRAVE_QUOTA_RESERVE     - monthly requests never spent by background jobs
+        BRAVE_MAX_QUEUE_WAIT    - longest a job thread waits for a slot; beyond that the
+                                  search raises QuotaWaitError and the job is requeued
+                                  for when the slot frees up (without using up an attempt)
+
+    Backends: the rate_limit_buckets table when a database is available,
+    otherwise an in-process bucket.
+    """
+
+    def __init__(self, db=None):
+        self.rate = float(os.getenv('BRAVE_RATE_LIMIT', '10'))
+        self.headroom = float(os.getenv('BRAVE_RATE_HEADROOM', '0.9'))
+        self.quota_low = int(os.getenv('BRAVE_QUOTA_LOW', '2000'))
+        self.quota_reserve = int(os.getenv('BRAVE_QUOTA_RESERVE', '100'))
+        self.max_wait = float(os.getenv('BRAVE_MAX_QUEUE_WAIT', '120'))
+        self.db = None
+        self.bucket = LocalTokenBucket(self.rate, max(1.0, self.rate))
+        self._lock = threading.Lock()
+        self._last_configured: Optional[Tuple[float, float]] = None
+        self._last_configured_at = 0.0
+        if db is not None:
+            self.attach_database(db)
+
+    def attach_database(self, db):
+        """Switch to the shared Postgres bucket (falls back to the local one on failure)"""
+        try:
+            self.bucket = PostgresTokenBucket(db, BUCKET_NAME, self.rate, max(1.0, self.rate))
+            self.db = db
+        except Exception as e:
+            logger.warning(f"Shared Brave rate limiter unavailable, using in-process limiter: {e}")
+
+    def acquire(self):
+        """Block until this process may send one Brave request (raises QuotaWaitError if too far off)"""
+        try:
+            granted, wait = self.bucket.reserve(self.max_wait)
+        except Exception as e:
+            # Never fail a search because the limiter's table is unreachable
+            logger.warning(f"Brave rate limiter reserve failed, pacing locally: {e}")
+            granted, wait = True, 1.0 / self.rate
+
+        if not granted:
+            raise QuotaWaitError(wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def observe(self, headers):
+        """Adapt the shared rate to the limits Brave reported on a response"""
+        info = parse_rate_limit_headers(headers)
+        if info is None:
+            return
+
+        rate = max(0.1, info['per_second_limit'] * self.headroom)
+        capacity = max(1.0, float(info['per_second_limit']))
+        remaining = info['monthly_remaining']
+        reset_seconds = info['monthly_reset_seconds']
+
+        if remaining is not None and reset_seconds and remaining <= self.quota_low:
+            # Spread what is left over the rest of the billing window rather than
+            # running dry and failing searches
+            spendable = max(0, remaining - self.quota_reserve)
+            rate = min(rate, max(spendable, 1) / reset_seconds)
+            capacity = 1.0
+
+        self._configure(rate, capacity, remaining)
+
+    def on_rate_limited(self, headers):
+        """A 429 means another client (or a stale rate) got there first - back off for the window"""
+        info = parse_rate_limit_headers(headers)
+        retry_after = headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            seconds = float(retry_after)
+        elif info and info['window_reset_seconds']:
+            seconds = float(info['window_reset_seconds'])
+        else:
+            seconds = 1.0
+        if info and info['monthly_remaining'] == 0 and info['monthly_reset_seconds']:
+            seconds = float(info['monthly_reset_seconds'])
+
+        logger.warning(f"Brave rate limited, pausing all workers for {seconds:.0f}s")
+        try:
+            self.bucket.pause(seconds)
+        except Exception as e:
+            logger.warning(f"Failed to pause Brave rate limiter: {e}")
+
+    def _configure(self, rate: float, capacity: float, quota_remaining: Optional[int]):
+        """Push a new rate to the bucket when it changed noticeably (or once a minute)"""
+        with self._lock:
+            now = time.time()
+            previous = self._last_configured
+            changed = previous is None or abs(previous[0] - rate) > 0.1 * previous[0] or previous[1] != capacity
+            if not changed and now - self._last_configured_at < 60:
+                return
+            self._last_configured = (rate, capacity)
+            self._last_configured_at = now
+            self.rate = rate
+
+        if previous is None or changed:
+            logger.info(f"Brave rate limit set to {rate:.3f} req/s (burst {capacity:.0f}, "
+                        f"monthly remaining {quota_remaining})")
+        try:
+            self.bucket.configure(rate, capacity, quota_remaining)
+        except Exception as e:
+            logger.warning(f"Failed to update Brave rate limiter: {e}")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_brave_quota(db=None) -> BraveQuotaManager:
+    """Process-wide Brave quota manager (shared bucket once a database is supplied)"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = BraveQuotaManager(db)
+        elif _manager.db is None and db is not None:
+            _manager.attach_database(db)
+        return _manager
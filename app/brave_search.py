@@ -5,25 +5,74 @@ Searches until no new documents are found, then confirms with one more iteration
 Integrated version for Heroku deployment.
 """
 
-import requests
-import time
-from typing import List, Dict, Set
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Set, Tuple
 import os
 
+from app import http_client
+from app.brave_quota import BraveQuotaManager, get_brave_quota
+from app.document_dedup import NearDuplicateClusterer, canonicalize_url
+from app.document_ranker import DocumentRanker
+from app.retry_policy import (
+    CIRCUIT_OPEN, QUOTA_WAIT, RATE_LIMITED, TRANSIENT_ERRORS, classify_error, get_circuit_breaker
+)
+from app.search_cache import SearchResultCache, get_search_cache, make_search_cache_key, normalize_query
+
+# DocumentRanker score that counts as one "full" relevant document when weighting yield
+RELEVANCE_UNIT_SCORE = 100.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool for issuing Brave queries concurrently"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.getenv('BRAVE_MAX_CONCURRENCY', '8'))
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='brave')
+        return _executor
+
 
 class AdaptiveDocumentSearch:
     """
     Adaptive search that continues until document exhaustion.
     """
     
-    def __init__(self, brave_api_key: str = None, max_iterations: int = 10, max_documents: int = 150):
+    def __init__(self, brave_api_key: str = None, max_iterations: int = 10, max_documents: int = 150,
+                 speculative: bool = None, cache: SearchResultCache = None,
+                 quota: BraveQuotaManager = None):
         self.brave_api_key = brave_api_key or os.getenv('BRAVE_API_KEY')
         if not self.brave_api_key:
             raise ValueError("BRAVE_API_KEY not provided and not found in environment")
             
         self.max_iterations = max_iterations
         self.max_documents = max_documents
+        # Issue the next iteration's queries while the current results are merged.
+        # Costs up to one extra iteration of queries per search, so off by default.
+        if speculative is None:
+            speculative = os.getenv('BRAVE_SPECULATIVE_ITERATION', 'false').lower() == 'true'
+        self.speculative = speculative
+        self.cache = cache or get_search_cache()
+        self.quota = quota or get_brave_quota()
+        self.rate_limit_retries = int(os.getenv('BRAVE_RATE_LIMIT_RETRIES', '3'))
+        # Marginal-yield stopping: stop once iterations add less than min_yield
+        # relevance-weighted new documents per query (0 disables)
+        self.min_yield = float(os.getenv('SEARCH_MIN_YIELD', '0.5'))
+        self.low_yield_patience = int(os.getenv('SEARCH_LOW_YIELD_PATIENCE', '2'))
+        self.min_iterations = int(os.getenv('SEARCH_MIN_ITERATIONS', '3'))
+        self.ranker = DocumentRanker()
+        self.clusterer = NearDuplicateClusterer()
+        self.near_duplicates_removed = 0
         self.search_count = 0
+        self.cache_hits = 0
+        self.speculative_wasted = 0
+        self.queries_saved = 0
+        self.stop_reason = None
+        self.last_error = None
         
     def search(self, company_name: str, isin: str = None, verbose: bool = True) -> List[Dict]:
         """
@@ -32,29 +81,49 @@ class AdaptiveDocumentSearch:
         Returns:
             List of unique document URLs with metadata
         """
-        all_documents = {}  # URL -> metadata
+        all_documents = {}  # Canonical URL -> metadata
         iteration = 0
         consecutive_no_new_docs = 0
+        consecutive_low_yield = 0
+        self.stop_reason = None
+        skipped_queries = set()  # Normalized queries the early stop kept from reaching Brave
         
         if verbose:
             print(f"🔍 Starting adaptive search for {company_name}")
         
+        pending = None  # Futures for the iteration about to run, if issued speculatively
+        
         while iteration < self.max_iterations and len(all_documents) < self.max_documents:
             iteration += 1
             
-            # Generate queries for this iteration
-            queries = self._generate_queries(company_name, isin, iteration)
+            # Issue this iteration's queries (unless already in flight)
+            if pending is None:
+                pending = self._submit_queries(self._generate_queries(company_name, isin, iteration))
+            futures, pending = pending, None
             
-            # Search with these queries
-            new_docs = self._search_iteration(queries, verbose=verbose)
+            # Speculatively start the next iteration while this one completes
+            if self.speculative and iteration < self.max_iterations:
+                pending = self._submit_queries(self._generate_queries(company_name, isin, iteration + 1))
+            
+            # Collect and dedupe this iteration's results (raises on outages and rate limits)
+            new_docs, failed = self._collect_results(futures, verbose=verbose)
+            query_count = len(futures) - failed
+            if query_count == 0:
+                # Every query failed permanently (e.g. rejected) - says nothing about exhaustion
+                continue
             
             # Count new documents
             new_urls = set(new_docs.keys())
             previously_unseen = new_urls - set(all_documents.keys())
             
+            # Relevance-weighted new documents per query issued this iteration
+            weighted_new = sum(self._relevance_weight(new_docs[url]) for url in previously_unseen)
+            iteration_yield = weighted_new / max(query_count, 1)
+            
             if verbose:
                 print(f"  Iteration {iteration}: Found {len(new_docs)} docs, "
-                      f"{len(previously_unseen)} new (total: {len(all_documents) + len(previously_unseen)})")
+                      f"{len(previously_unseen)} new (total: {len(all_documents) + len(previously_unseen)}, "
+                      f"yield {iteration_yield:.2f}/query)")
             
             # Add new documents
             for url in previously_unseen:
@@ -68,10 +137,42 @@ class AdaptiveDocumentSearch:
                     # No new docs for 2 iterations - we're exhausted
                     if verbose:
                         print(f"  ✅ Search exhausted after {iteration} iterations")
+                    self.stop_reason = 'exhausted'
                     break
             else:
                 # Found new docs, reset counter
                 consecutive_no_new_docs = 0
+            
+            if iteration_yield < self.min_yield:
+                consecutive_low_yield += 1
+                
+                if iteration >= self.min_iterations and consecutive_low_yield >= self.low_yield_patience:
+                    # Still trickling in, but not enough relevant documents to pay for more queries
+                    skipped_queries = self._skipped_queries(company_name, isin, iteration)
+                    self.queries_saved = len(skipped_queries)
+                    if verbose:
+                        print(f"  ✅ Stopping after {iteration} iterations: yield below {self.min_yield}/query "
+                              f"({self.queries_saved} queries saved)")
+                    self.stop_reason = 'low_yield'
+                    break
+            else:
+                consecutive_low_yield = 0
+        
+        if pending is not None:
+            # Search ended early - drop the speculative queries that have not started yet
+            started = [(query, future) for query, future in pending if not future.cancel()]
+            self.speculative_wasted += len(started)
+            skipped_queries -= {normalize_query(query) for query, _ in started}
+            self.queries_saved = len(skipped_queries)
+            self._collect_results(started, verbose=False, raise_transient=False)
+        
+        if self.stop_reason is None:
+            self.stop_reason = 'max_documents' if len(all_documents) >= self.max_documents else 'max_iterations'
+        
+        # Collapse mirrors and re-syndicated copies to one source each
+        documents = self.clusterer.deduplicate(list(all_documents.values()),
+                                               self.ranker._calculate_relevance_score)
+        self.near_duplicates_removed = len(all_documents) - len(documents)
         
         if verbose:
             if iteration >= self.max_iterations:
@@ -80,9 +181,37 @@ class AdaptiveDocumentSearch:
             if len(all_documents) >= self.max_documents:
                 print(f"  ⚠️  Reached max documents ({self.max_documents})")
             
-            print(f"  📚 Total unique documents: {len(all_documents)}")
+            if self.near_duplicates_removed:
+                print(f"  🧹 Merged {self.near_duplicates_removed} near-duplicate documents")
+            
+            print(f"  📚 Total unique documents: {len(documents)}")
+        
+        if self.search_count + self.cache_hits == 0 and self.last_error is not None:
+            # Every query failed (rate limit, outage) - surface it so the job can be retried
+            raise self.last_error
         
-        return list(all_documents.values())
+        return documents
+    
+    def _relevance_weight(self, doc: Dict) -> float:
+        """
+        How much a new document counts towards yield: 1.0 per RELEVANCE_UNIT_SCORE of
+        DocumentRanker relevance (a report or official source), down to 0.1 for
+        generic or news results, capped at 3.0
+        """
+        score = self.ranker._calculate_relevance_score(doc)
+        return min(3.0, max(0.1, score / RELEVANCE_UNIT_SCORE))
+    
+    def _skipped_queries(self, company_name: str, isin: str, iteration: int) -> Set[str]:
+        """
+        Normalized queries the remaining iterations (up to max_iterations) would have
+        sent to Brave: later iterations cycle back to queries already issued, which
+        would have been search cache hits
+        """
+        issued = {normalize_query(query) for i in range(1, iteration + 1)
+                  for query in self._generate_queries(company_name, isin, i)}
+        remaining = {normalize_query(query) for i in range(iteration + 1, self.max_iterations + 1)
+                     for query in self._generate_queries(company_name, isin, i)}
+        return remaining - issued
     
     def _generate_queries(self, company_name: str, isin: str, iteration_num: int) -> List[str]:
         """
@@ -143,27 +272,90 @@ class AdaptiveDocumentSearch:
     
     def _search_iteration(self, queries: List[str], verbose: bool = True) -> Dict[str, Dict]:
         """
-        Execute multiple queries and return deduplicated results.
+        Execute multiple queries concurrently and return deduplicated results.
+        """
+        results, _ = self._collect_results(self._submit_queries(queries), verbose=verbose)
+        return results
+    
+    def _submit_queries(self, queries: List[str]) -> List[tuple]:
+        """
+        Issue queries on the shared search pool, paced by the process-wide rate limiter.
+        
+        Returns:
+            List of (query, future) in query order
+        """
+        executor = get_search_executor()
+        return [(query, executor.submit(self._cached_search, query, 20)) for query in queries]
+    
+    def _collect_results(self, futures: List[tuple], verbose: bool = True,
+                         raise_transient: bool = True) -> Tuple[Dict[str, Dict], int]:
+        """
+        Wait for submitted queries and merge their results, keyed by canonical URL;
+        the first query wins on duplicates.
+        
+        Transient failures (outage, timeout, rate limit, open circuit, quota wait) are raised
+        rather than returning a silently truncated document set: the job is requeued
+        and queries that did succeed are served from the search cache next time.
+        
+        Returns:
+            (results, number of queries that failed permanently)
         """
         all_results = {}
+        failed = 0
         
-        for query in queries:
+        for query, future in futures:
             try:
-                results = self._brave_search(query, count=20)
+                results, from_cache = future.result()
                 
                 for result in results:
-                    url = result['url']
+                    url = canonicalize_url(result['url'])
                     if url not in all_results:
                         all_results[url] = result
                 
-                self.search_count += 1
-                time.sleep(0.1)  # Small delay to be respectful
+                if from_cache:
+                    self.cache_hits += 1
+                else:
+                    self.search_count += 1
                 
             except Exception as e:
+                self.last_error = e
                 if verbose:
                     print(f"    ⚠️  Search failed for '{query[:50]}...': {e}")
+                error_class = classify_error(e)
+                retryable = error_class in TRANSIENT_ERRORS or error_class in (CIRCUIT_OPEN, QUOTA_WAIT)
+                if raise_transient and retryable:
+                    raise
+                failed += 1
         
-        return all_results
+        return all_results, failed
+    
+    def _cached_search(self, query: str, count: int = 20) -> tuple:
+        """
+        Serve a query from the search cache, or from Brave (rate limited) on a miss.
+        
+        Returns:
+            (results, from_cache)
+        """
+        cache_key = make_search_cache_key('brave', query, {'count': count, 'search_lang': 'en'})
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+        
+        attempt = 0
+        while True:
+            self.quota.acquire()
+            try:
+                results = self._brave_search(query, count=count)
+                break
+            except httpx.HTTPStatusError as e:
+                attempt += 1
+                if e.response.status_code != 429 or attempt > self.rate_limit_retries:
+                    raise
+                # Queue behind the pause on_rate_limited() put on the shared bucket
+                self.quota.on_rate_limited(e.response.headers)
+        
+        self.cache.set(cache_key, query, results)
+        return results, False
     
     def _brave_search(self, query: str, count: int = 20) -> List[Dict]:
         """
@@ -183,8 +375,20 @@ class AdaptiveDocumentSearch:
             "search_lang": "en"
         }
         
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
+        breaker = get_circuit_breaker('brave')
+        breaker.before_call()
+        try:
+            response = http_client.get(url, headers=headers, params=params, timeout=10)
+            self.quota.observe(response.headers)
+            response.raise_for_status()
+        except Exception as e:
+            if classify_error(e) == RATE_LIMITED:
+                # 429s mean "slow down", not "down" - BraveQuotaManager queues behind them
+                breaker.record_inconclusive()
+            else:
+                breaker.record_failure(e)
+            raise
+        breaker.record_success()
         
         data = response.json()
         results = []
@@ -5,31 +5,80 @@ Handles all database operations and schema initialization
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.pool import ThreadedConnectionPool
 import logging
+import select
+import threading
 from datetime import datetime
 from typing import Optional, Dict, List
 import json
 
+from app.processprompt_index import build_section_index, is_usable
+
 logger = logging.getLogger(__name__)
 
 # Database connection pool
 _pool = None
+_pool_lock = threading.Lock()
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """Thread-safe pool that waits for a free connection instead of raising when exhausted"""
+    
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+    
+    def getconn(self, key=None):
+        self._slots.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+# NOTIFY channel for newly created jobs (payload: job id)
+JOB_CHANNEL = 'assessment_jobs'
+
+# Queue lanes: interactive (single submissions) jump ahead of bulk (uploads, syncs)
+LANE_INTERACTIVE = 'interactive'
+LANE_BULK = 'bulk'
+
+# Pipeline stages: retrieval (Brave search) hands off to assessment (DeepSeek batches)
+# through the 'search' checkpoint and a return to the pending queue
+STAGE_RETRIEVAL = 'retrieval'
+STAGE_ASSESSMENT = 'assessment'
+
+# How long a claimed job stays owned by a worker without a heartbeat
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '600'))
+
+def get_database_url() -> str:
+    """Get the DATABASE_URL in a form psycopg2 accepts"""
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable not set")
+    
+    # Heroku uses postgres://, but psycopg2 needs postgresql://
+    if database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+    return database_url
 
 def get_pool():
     """Get or create database connection pool"""
     global _pool
-    if _pool is None:
-        database_url = os.getenv('DATABASE_URL')
-        if not database_url:
-            raise ValueError("DATABASE_URL environment variable not set")
-        
-        # Heroku uses postgres://, but psycopg2 needs postgresql://
-        if database_url.startswith('postgres://'):
-            database_url = database_url.replace('postgres://', 'postgresql://', 1)
-        
-        _pool = SimpleConnectionPool(1, 20, database_url)
-        logger.info("Database connection pool created")
+    with _pool_lock:
+        if _pool is None:
+            database_url = get_database_url()
+            
+            # Shared by every job thread in the process (worker jobs x batch calls)
+            max_connections = int(os.getenv('DB_POOL_MAX', '20'))
+            _pool = BlockingConnectionPool(1, max_connections, database_url)
+            logger.info(f"Database connection pool created (max {max_connections} connections)")
     
     return _pool
 
@@ -141,12 +190,165 @@ def init_database():
                 )
             """)
             
+            # Parsed ProcessPrompt sections (shared sections + per-measure definitions)
+            cursor.execute("""
+                ALTER TABLE processprompt_versions
+                ADD COLUMN IF NOT EXISTS section_index JSONB
+            """)
+            
+            # Per-job flag to skip the LLM response cache (forces fresh DeepSeek calls)
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS bypass_llm_cache BOOLEAN DEFAULT FALSE
+            """)
+            
+            # Measures parsed so far for an in-flight job (streamed partial progress)
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS partial_measures JSONB
+            """)
+            
+            # Job leases: a worker must keep extending the lease while it runs a job,
+            # otherwise the reaper returns the job to the queue
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS attempts INTEGER DEFAULT 0
+            """)
+            
+            # Lease owner: a fresh token per claim, so a worker whose lease expired
+            # can't heartbeat, advance, complete or fail a job another worker re-claimed
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS claim_token VARCHAR(32)
+            """)
+            
+            # Scheduling: lane first, then priority, then round-robin across batches
+            # (batch_id groups one upload/sync or one submitter)
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS lane VARCHAR(20) DEFAULT 'bulk',
+                ADD COLUMN IF NOT EXISTS priority INTEGER DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS batch_id VARCHAR(100)
+            """)
+            
+            # Next pipeline stage to run for the job
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS stage VARCHAR(20) DEFAULT 'retrieval'
+            """)
+            
+            # Retried jobs wait in pending until run_after (backoff)
+            cursor.execute("""
+                ALTER TABLE assessment_jobs
+                ADD COLUMN IF NOT EXISTS run_after TIMESTAMP
+            """)
+            
+            # Create llm_response_cache table (responses keyed by prompt hash)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    cache_key VARCHAR(64) PRIMARY KEY,
+                    model VARCHAR(100),
+                    response TEXT NOT NULL,
+                    size_bytes INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Create search_result_cache table (Brave results keyed by normalized query + params)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS search_result_cache (
+                    cache_key VARCHAR(64) PRIMARY KEY,
+                    query TEXT,
+                    results JSONB NOT NULL,
+                    hit_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_accessed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Create rate_limit_buckets table (token buckets shared by all workers, e.g. Brave)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    name VARCHAR(50) PRIMARY KEY,
+                    tokens DOUBLE PRECISION NOT NULL,
+                    capacity DOUBLE PRECISION NOT NULL,
+                    refill_rate DOUBLE PRECISION NOT NULL,
+                    quota_remaining INTEGER,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Create job_checkpoints table (completed pipeline stages, for resuming retried jobs)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS job_checkpoints (
+                    job_id INTEGER REFERENCES assessment_jobs(id),
+                    stage VARCHAR(50) NOT NULL,
+                    data JSONB NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (job_id, stage)
+                )
+            """)
+            
+            # Create worker_heartbeats table (live worker registry for queue metrics)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS worker_heartbeats (
+                    worker_id VARCHAR(100) PRIMARY KEY,
+                    concurrency INTEGER,
+                    in_flight INTEGER,
+                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Create job_metrics table (one row per search stage / LLM call)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS job_metrics (
+                    id SERIAL PRIMARY KEY,
+                    job_id INTEGER REFERENCES assessment_jobs(id),
+                    stage VARCHAR(20) NOT NULL,
+                    batch_num INTEGER,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    cached_tokens INTEGER,
+                    latency_ms INTEGER,
+                    finish_reason VARCHAR(30),
+                    query_count INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Searches served from the search result cache (no Brave request)
+            cursor.execute("""
+                ALTER TABLE job_metrics
+                ADD COLUMN IF NOT EXISTS search_cache_hits INTEGER
+            """)
+            
+            # Brave queries not issued because search stopped on low marginal yield
+            cursor.execute("""
+                ALTER TABLE job_metrics
+                ADD COLUMN IF NOT EXISTS queries_saved INTEGER
+            """)
+            
             # Create indexes
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_companies_isin ON companies(isin)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON assessment_jobs(status)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON assessment_jobs(status, lease_expires_at)")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_jobs_pending_lane
+                ON assessment_jobs(lane, batch_id, priority DESC, created_at)
+                WHERE status = 'pending'
+            """)
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_company ON assessment_jobs(company_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_assessments_job ON assessments(job_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_assessments_company ON assessments(company_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_response_cache(last_accessed_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_created ON search_result_cache(created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_metrics_job ON job_metrics(job_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_metrics_created ON job_metrics(created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_completed ON assessment_jobs(completed_at)")
             
             conn.commit()
             logger.info("Database schema initialized successfully")
@@ -158,6 +360,78 @@ def init_database():
     finally:
         release_connection(conn)
 
+class JobNotificationListener:
+    """
+    Dedicated LISTEN connection that lets a worker sleep until a job is created
+    
+    wait() returns on a NOTIFY on JOB_CHANNEL, on wake() (e.g. a local job
+    finished and freed a slot) or after the timeout, whichever comes first.
+    If the connection is lost it is re-opened on the next wait(); until then
+    wait() degrades to a plain timed sleep.
+    """
+    
+    def __init__(self):
+        self.conn = None
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+    
+    def _connect(self):
+        try:
+            self.conn = psycopg2.connect(get_database_url())
+            self.conn.autocommit = True
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {JOB_CHANNEL}")
+            logger.info(f"Listening for job notifications on '{JOB_CHANNEL}'")
+        except Exception as e:
+            logger.warning(f"Job notification listener unavailable, falling back to polling: {e}")
+            self.close()
+    
+    def wake(self):
+        """Interrupt a pending wait() from another thread"""
+        try:
+            os.write(self._wake_write, b'x')
+        except BlockingIOError:
+            pass  # A wake-up is already pending
+    
+    def wait(self, timeout: float) -> bool:
+        """Block until a notification, wake() or timeout; returns True if woken early"""
+        if self.conn is None:
+            self._connect()
+        
+        readers = [self._wake_read] + ([self.conn] if self.conn is not None else [])
+        try:
+            ready, _, _ = select.select(readers, [], [], timeout)
+        except Exception as e:
+            logger.warning(f"Job notification wait failed: {e}")
+            self.close()
+            return False
+        
+        if self._wake_read in ready:
+            try:
+                while os.read(self._wake_read, 1024):
+                    pass
+            except BlockingIOError:
+                pass
+        
+        if self.conn is not None and self.conn in ready:
+            try:
+                self.conn.poll()
+                self.conn.notifies.clear()
+            except Exception as e:
+                logger.warning(f"Job notification connection lost: {e}")
+                self.close()
+        
+        return bool(ready)
+    
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
 class Database:
     """Database operations wrapper"""
     
@@ -199,98 +473,428 @@ class Database:
         finally:
             self.release_connection(conn)
     
-    def create_job(self, company_id: int) -> int:
+    def create_job(self, company_id: int, bypass_llm_cache: bool = False,
+                   lane: str = LANE_INTERACTIVE, priority: int = 0, batch_id: str = None) -> int:
         """Create a new assessment job"""
         conn = self.get_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    INSERT INTO assessment_jobs (company_id, status)
-                    VALUES (%s, 'pending')
+                    INSERT INTO assessment_jobs (company_id, status, bypass_llm_cache, lane, priority, batch_id)
+                    VALUES (%s, 'pending', %s, %s, %s, %s)
                     RETURNING id
-                """, (company_id,))
+                """, (company_id, bypass_llm_cache, lane, priority, batch_id))
                 
                 job_id = cursor.fetchone()['id']
+                
+                # Delivered to listening workers when the transaction commits
+                cursor.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, str(job_id)))
                 conn.commit()
                 return job_id
                 
         finally:
             self.release_connection(conn)
     
-    def get_pending_jobs(self, limit: int = 1) -> List[Dict]:
-        """Get pending jobs"""
+    def get_pending_jobs(self, limit: int = 1, preferred_lane: str = LANE_INTERACTIVE,
+                         stage: str = None) -> List[Dict]:
+        """
+        Claim up to limit pending jobs with their company details in one round trip
+        
+        Jobs in preferred_lane go first, then higher priority. Within a lane and
+        priority, batches take turns (the n-th job of every batch before the
+        (n+1)-th of any), oldest first. If stage is given, only jobs waiting for
+        that pipeline stage are claimed.
+        """
         conn = self.get_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    UPDATE assessment_jobs
-                    SET status = 'processing', started_at = CURRENT_TIMESTAMP
-                    WHERE id IN (
-                        SELECT id FROM assessment_jobs
+                    WITH ranked AS (
+                        SELECT 
+                            id,
+                            CASE WHEN lane = %(lane)s THEN 0 ELSE 1 END as lane_rank,
+                            COALESCE(priority, 0) as priority,
+                            ROW_NUMBER() OVER (
+                                PARTITION BY lane, COALESCE(priority, 0), COALESCE(batch_id, '')
+                                ORDER BY created_at, id
+                            ) as turn,
+                            created_at
+                        FROM assessment_jobs
                         WHERE status = 'pending'
-                        ORDER BY created_at ASC
-                        LIMIT %s
-                        FOR UPDATE SKIP LOCKED
+                          AND (%(stage)s IS NULL OR stage = %(stage)s)
+                          AND (run_after IS NULL OR run_after <= CURRENT_TIMESTAMP)
+                    ),
+                    candidates AS (
+                        SELECT j.id
+                        FROM assessment_jobs j
+                        JOIN ranked r ON r.id = j.id
+                        WHERE j.status = 'pending'
+                        ORDER BY r.lane_rank, r.priority DESC, r.turn, r.created_at, r.id
+                        LIMIT %(limit)s
+                        FOR UPDATE OF j SKIP LOCKED
+                    ),
+                    claimed AS (
+                        UPDATE assessment_jobs
+                        SET status = 'processing',
+                            -- Keep the retrieval start time when the assessment stage picks the job up
+                            started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                            heartbeat_at = CURRENT_TIMESTAMP,
+                            lease_expires_at = CURRENT_TIMESTAMP + (%(lease)s * INTERVAL '1 second'),
+                            attempts = COALESCE(attempts, 0) + 1,
+                            claim_token = md5(random()::text || clock_timestamp()::text || id::text),
+                            partial_measures = NULL
+                        WHERE id IN (SELECT id FROM candidates)
+                        RETURNING id, company_id, bypass_llm_cache, created_at, attempts, lane, priority, batch_id, stage,
+                                  claim_token
                     )
-                    RETURNING id, company_id
-                """, (limit,))
+                    SELECT 
+                        claimed.id,
+                        claimed.company_id,
+                        c.name as company,
+                        c.isin,
+                        c.sector,
+                        c.industry,
+                        c.country,
+                        COALESCE(claimed.bypass_llm_cache, FALSE) as bypass_llm_cache,
+                        claimed.attempts,
+                        claimed.lane,
+                        claimed.priority,
+                        claimed.batch_id,
+                        COALESCE(claimed.stage, 'retrieval') as stage,
+                        claimed.claim_token
+                    FROM claimed
+                    JOIN companies c ON claimed.company_id = c.id
+                    ORDER BY CASE WHEN claimed.lane = %(lane)s THEN 0 ELSE 1 END,
+                             claimed.priority DESC, claimed.created_at ASC, claimed.id ASC
+                """, {'lane': preferred_lane, 'limit': limit, 'lease': JOB_LEASE_SECONDS, 'stage': stage})
                 
                 jobs = cursor.fetchall()
                 conn.commit()
+                return jobs
                 
-                # Get company details for each job
-                result = []
-                for job in jobs:
-                    cursor.execute("""
-                        SELECT id, name, isin, sector, industry, country
-                        FROM companies WHERE id = %s
-                    """, (job['company_id'],))
-                    company = cursor.fetchone()
-                    
-                    result.append({
-                        'id': job['id'],
-                        'company_id': job['company_id'],
-                        'company': company['name'],
-                        'isin': company['isin'],
-                        'sector': company.get('sector'),
-                        'industry': company.get('industry'),
-                        'country': company.get('country')
-                    })
+        finally:
+            self.release_connection(conn)
+    
+    def requeue_job(self, job_id: int, delay_seconds: float, error_message: str = None,
+                    claim_token: str = None, refund_attempt: bool = False) -> bool:
+        """
+        Return a failed attempt to pending, claimable again after delay_seconds
+        
+        With claim_token, only if that claim still owns the job; returns whether it did.
+        refund_attempt=True doesn't count the attempt (e.g. it only waited for quota).
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE assessment_jobs
+                    SET status = 'pending',
+                        run_after = CURRENT_TIMESTAMP + (%s * INTERVAL '1 second'),
+                        started_at = NULL,
+                        lease_expires_at = NULL,
+                        claim_token = NULL,
+                        partial_measures = NULL,
+                        attempts = CASE WHEN %s THEN GREATEST(COALESCE(attempts, 1) - 1, 0) ELSE attempts END,
+                        error_message = %s
+                    WHERE id = %s
+                      AND (%s::text IS NULL OR (status = 'processing' AND claim_token = %s))
+                """, (delay_seconds, refund_attempt, error_message, job_id, claim_token, claim_token))
+                
+                requeued = cursor.rowcount > 0
+                conn.commit()
+                return requeued
+                
+        finally:
+            self.release_connection(conn)
+    
+    def advance_job_stage(self, job_id: int, stage: str, claim_token: str) -> bool:
+        """
+        Hand a job to the next pipeline stage: back to pending, claimable by that stage's workers
+        
+        Only if claim_token still owns the job; returns whether it did.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE assessment_jobs
+                    SET status = 'pending',
+                        stage = %s,
+                        attempts = 0,
+                        lease_expires_at = NULL,
+                        claim_token = NULL
+                    WHERE id = %s AND status = 'processing' AND claim_token = %s
+                """, (stage, job_id, claim_token))
+                
+                advanced = cursor.rowcount > 0
+                if advanced:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, str(job_id)))
+                conn.commit()
+                return advanced
+                
+        finally:
+            self.release_connection(conn)
+    
+    def release_jobs(self, claims: Dict[int, str]) -> int:
+        """Return claimed jobs ({job id: claim token}) to the pending queue, if those claims still own them"""
+        if not claims:
+            return 0
+        
+        job_ids = list(claims.keys())
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE assessment_jobs j
+                    SET status = 'pending',
+                        started_at = NULL,
+                        lease_expires_at = NULL,
+                        claim_token = NULL,
+                        partial_measures = NULL,
+                        attempts = GREATEST(COALESCE(j.attempts, 1) - 1, 0)
+                    FROM unnest(%s::int[], %s::text[]) AS c(id, claim_token)
+                    WHERE j.id = c.id AND j.claim_token = c.claim_token AND j.status = 'processing'
+                """, (job_ids, [claims[job_id] for job_id in job_ids]))
+                
+                released = cursor.rowcount
+                if released:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, 'released'))
+                conn.commit()
+                return released
+                
+        finally:
+            self.release_connection(conn)
+    
+    def extend_job_leases(self, claims: Dict[int, str]) -> List[int]:
+        """
+        Heartbeat: extend the leases of jobs ({job id: claim token}) still owned by those claims
+        
+        Returns:
+            The job ids still held; a missing id was reaped (and possibly re-claimed elsewhere)
+        """
+        if not claims:
+            return []
+        
+        job_ids = list(claims.keys())
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE assessment_jobs j
+                    SET heartbeat_at = CURRENT_TIMESTAMP,
+                        lease_expires_at = CURRENT_TIMESTAMP + (%s * INTERVAL '1 second')
+                    FROM unnest(%s::int[], %s::text[]) AS c(id, claim_token)
+                    WHERE j.id = c.id AND j.claim_token = c.claim_token AND j.status = 'processing'
+                    RETURNING j.id
+                """, (JOB_LEASE_SECONDS, job_ids, [claims[job_id] for job_id in job_ids]))
                 
-                return result
+                held = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+                return held
                 
         finally:
             self.release_connection(conn)
     
-    def update_job_status(self, job_id: int, status: str, error_message: str = None):
-        """Update job status"""
+    def reap_expired_jobs(self, max_attempts: int) -> Dict:
+        """
+        Return jobs whose lease expired to pending, or fail them after max_attempts,
+        and drop the checkpoints of jobs that will never run again
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Rows claimed before leases existed have no lease_expires_at
+                expired = """
+                    status = 'processing'
+                    AND COALESCE(lease_expires_at, started_at + (%s * INTERVAL '1 second')) < CURRENT_TIMESTAMP
+                """
+                
+                cursor.execute(f"""
+                    UPDATE assessment_jobs
+                    SET status = 'failed',
+                        completed_at = CURRENT_TIMESTAMP,
+                        lease_expires_at = NULL,
+                        claim_token = NULL,
+                        error_message = 'Lease expired after ' || COALESCE(attempts, 0) || ' attempt(s)'
+                    WHERE {expired} AND COALESCE(attempts, 0) >= %s
+                    RETURNING id
+                """, (JOB_LEASE_SECONDS, max_attempts))
+                failed = [row[0] for row in cursor.fetchall()]
+                
+                cursor.execute(f"""
+                    UPDATE assessment_jobs
+                    SET status = 'pending',
+                        started_at = NULL,
+                        lease_expires_at = NULL,
+                        claim_token = NULL,
+                        partial_measures = NULL
+                    WHERE {expired}
+                    RETURNING id
+                """, (JOB_LEASE_SECONDS,))
+                requeued = [row[0] for row in cursor.fetchall()]
+                
+                # Checkpoints only serve a later attempt - none comes for completed or failed jobs
+                cursor.execute("""
+                    DELETE FROM job_checkpoints cp
+                    USING assessment_jobs j
+                    WHERE cp.job_id = j.id AND j.status IN ('completed', 'failed')
+                """)
+                
+                if requeued:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, 'requeued'))
+                conn.commit()
+                return {'requeued': requeued, 'failed': failed}
+                
+        finally:
+            self.release_connection(conn)
+    
+    def update_job_status(self, job_id: int, status: str, error_message: str = None,
+                          claim_token: str = None) -> bool:
+        """
+        Update job status
+        
+        With claim_token, only if that claim still owns the (processing) job;
+        returns whether the job was updated.
+        """
+        owned = "AND status = 'processing' AND claim_token = %s" if claim_token else ""
+        owner_args = (claim_token,) if claim_token else ()
+        
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
                 if status == 'completed':
-                    cursor.execute("""
+                    cursor.execute(f"""
                         UPDATE assessment_jobs
-                        SET status = %s, completed_at = CURRENT_TIMESTAMP
-                        WHERE id = %s
-                    """, (status, job_id))
+                        SET status = %s, completed_at = CURRENT_TIMESTAMP, lease_expires_at = NULL,
+                            claim_token = NULL, partial_measures = NULL
+                        WHERE id = %s {owned}
+                    """, (status, job_id) + owner_args)
                 elif status == 'failed':
-                    cursor.execute("""
+                    cursor.execute(f"""
+                        UPDATE assessment_jobs
+                        SET status = %s, completed_at = CURRENT_TIMESTAMP, error_message = %s,
+                            lease_expires_at = NULL, claim_token = NULL, partial_measures = NULL
+                        WHERE id = %s {owned}
+                    """, (status, error_message, job_id) + owner_args)
+                elif status == 'processing':
+                    cursor.execute(f"""
                         UPDATE assessment_jobs
-                        SET status = %s, completed_at = CURRENT_TIMESTAMP, error_message = %s
-                        WHERE id = %s
-                    """, (status, error_message, job_id))
+                        SET status = %s, started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP,
+                            lease_expires_at = CURRENT_TIMESTAMP + (%s * INTERVAL '1 second')
+                        WHERE id = %s {owned}
+                    """, (status, JOB_LEASE_SECONDS, job_id) + owner_args)
                 else:
-                    cursor.execute("""
+                    cursor.execute(f"""
                         UPDATE assessment_jobs
                         SET status = %s
-                        WHERE id = %s
-                    """, (status, job_id))
+                        WHERE id = %s {owned}
+                    """, (status, job_id) + owner_args)
+                
+                updated = cursor.rowcount > 0
+                conn.commit()
+                return updated
+                
+        finally:
+            self.release_connection(conn)
+    
+    def save_partial_measures(self, job_id: int, measures: Dict, claim_token: str):
+        """Merge parsed measures into the job's partial progress, if claim_token still owns the job"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE assessment_jobs
+                    SET partial_measures = COALESCE(partial_measures, '{}'::jsonb) || %s::jsonb
+                    WHERE id = %s AND status = 'processing' AND claim_token = %s
+                """, (json.dumps(measures), job_id, claim_token))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def save_job_checkpoint(self, job_id: int, stage: str, data: Dict, merge: bool = False):
+        """Persist a completed pipeline stage (merge=True merges keys into an existing checkpoint)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                update = "job_checkpoints.data || EXCLUDED.data" if merge else "EXCLUDED.data"
+                cursor.execute(f"""
+                    INSERT INTO job_checkpoints (job_id, stage, data)
+                    VALUES (%s, %s, %s::jsonb)
+                    ON CONFLICT (job_id, stage) DO UPDATE
+                    SET data = {update}, updated_at = CURRENT_TIMESTAMP
+                """, (job_id, stage, json.dumps(data)))
                 
                 conn.commit()
                 
         finally:
             self.release_connection(conn)
     
+    def get_job_checkpoints(self, job_id: int) -> Dict[str, Dict]:
+        """Get all checkpoints for a job, keyed by stage"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT stage, data FROM job_checkpoints WHERE job_id = %s
+                """, (job_id,))
+                return {row['stage']: row['data'] for row in cursor.fetchall()}
+                
+        finally:
+            self.release_connection(conn)
+    
+    def delete_job_checkpoints(self, job_id: int):
+        """Drop a job's checkpoints once its assessment is saved"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM job_checkpoints WHERE job_id = %s", (job_id,))
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def get_job_progress(self, job_id: int) -> Optional[Dict]:
+        """Get job status with any partial measures saved so far"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT 
+                        j.id,
+                        j.status,
+                        j.started_at,
+                        j.completed_at,
+                        c.name as company_name,
+                        c.isin,
+                        COALESCE(j.partial_measures, '{}'::jsonb) as partial_measures
+                    FROM assessment_jobs j
+                    JOIN companies c ON j.company_id = c.id
+                    WHERE j.id = %s
+                """, (job_id,))
+                return cursor.fetchone()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def _insert_assessment(self, cursor, job_id: int, company_id: int, processprompt_version_id: Optional[int],
+                           assessment_data: Dict):
+        cursor.execute("""
+            INSERT INTO assessments (
+                job_id, company_id, processprompt_version_id,
+                overall_risk_rating, physical_risk_score, transition_risk_score,
+                full_assessment, measures_detail
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            job_id, company_id, processprompt_version_id,
+            assessment_data.get('overall_risk_rating'),
+            assessment_data.get('physical_risk_score'),
+            assessment_data.get('transition_risk_score'),
+            json.dumps(assessment_data),
+            json.dumps(assessment_data.get('measures', {}))
+        ))
+    
     def save_assessment(self, job_id: int, company_id: int, assessment_data: Dict):
         """Save assessment results"""
         conn = self.get_connection()
@@ -303,22 +907,46 @@ class Database:
                 result = cursor.fetchone()
                 processprompt_version_id = result[0] if result else None
                 
+                self._insert_assessment(cursor, job_id, company_id, processprompt_version_id, assessment_data)
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def complete_job(self, job_id: int, company_id: int, assessment_data: Dict, claim_token: str) -> bool:
+        """
+        Save assessment results and mark the job completed in one transaction,
+        only if claim_token still owns the job
+        
+        Returns:
+            False if the lease was lost (nothing is saved)
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # Lock the job row so the reaper can't requeue it between the check and the save
+                cursor.execute("""
+                    SELECT processprompt_version_id FROM assessment_jobs
+                    WHERE id = %s AND status = 'processing' AND claim_token = %s
+                    FOR UPDATE
+                """, (job_id, claim_token))
+                result = cursor.fetchone()
+                if result is None:
+                    conn.rollback()
+                    return False
+                
+                self._insert_assessment(cursor, job_id, company_id, result[0], assessment_data)
+                
                 cursor.execute("""
-                    INSERT INTO assessments (
-                        job_id, company_id, processprompt_version_id,
-                        overall_risk_rating, physical_risk_score, transition_risk_score,
-                        full_assessment, measures_detail
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    job_id, company_id, processprompt_version_id,
-                    assessment_data.get('overall_risk_rating'),
-                    assessment_data.get('physical_risk_score'),
-                    assessment_data.get('transition_risk_score'),
-                    json.dumps(assessment_data),
-                    json.dumps(assessment_data.get('measures', {}))
-                ))
+                    UPDATE assessment_jobs
+                    SET status = 'completed', completed_at = CURRENT_TIMESTAMP, lease_expires_at = NULL,
+                        claim_token = NULL, partial_measures = NULL
+                    WHERE id = %s
+                """, (job_id,))
                 
                 conn.commit()
+                return True
                 
         finally:
             self.release_connection(conn)
@@ -329,7 +957,7 @@ class Database:
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    SELECT id, version_name, content
+                    SELECT id, version_name, content, section_index
                     FROM processprompt_versions
                     WHERE is_active = TRUE
                     ORDER BY uploaded_at DESC
@@ -340,6 +968,439 @@ class Database:
         finally:
             self.release_connection(conn)
     
+    def get_llm_cache_entry(self, cache_key: str, ttl_seconds: int) -> Optional[str]:
+        """Get a cached LLM response if present and younger than ttl_seconds"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    UPDATE llm_response_cache
+                    SET last_accessed_at = CURRENT_TIMESTAMP
+                    WHERE cache_key = %s
+                      AND created_at > CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                    RETURNING response
+                """, (cache_key, ttl_seconds))
+                
+                result = cursor.fetchone()
+                conn.commit()
+                return result['response'] if result else None
+                
+        finally:
+            self.release_connection(conn)
+    
+    def save_llm_cache_entry(self, cache_key: str, model: str, response: str):
+        """Insert or refresh a cached LLM response"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO llm_response_cache (cache_key, model, response, size_bytes)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET response = EXCLUDED.response,
+                        size_bytes = EXCLUDED.size_bytes,
+                        created_at = CURRENT_TIMESTAMP,
+                        last_accessed_at = CURRENT_TIMESTAMP
+                """, (cache_key, model, response, len(response.encode('utf-8'))))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def evict_llm_cache(self, ttl_seconds: int, max_bytes: int) -> int:
+        """Delete expired cache entries, then least recently used ones until under max_bytes"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM llm_response_cache
+                    WHERE created_at <= CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                """, (ttl_seconds,))
+                deleted = cursor.rowcount
+                
+                cursor.execute("""
+                    DELETE FROM llm_response_cache
+                    WHERE cache_key IN (
+                        SELECT cache_key FROM (
+                            SELECT cache_key,
+                                   SUM(size_bytes) OVER (ORDER BY last_accessed_at DESC, cache_key) AS running_bytes
+                            FROM llm_response_cache
+                        ) ranked
+                        WHERE running_bytes > %s
+                    )
+                """, (max_bytes,))
+                deleted += cursor.rowcount
+                
+                conn.commit()
+                return deleted
+                
+        finally:
+            self.release_connection(conn)
+    
+    def get_search_cache_entry(self, cache_key: str, ttl_seconds: int) -> Optional[Dict]:
+        """Get cached search results and their age if younger than ttl_seconds"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    UPDATE search_result_cache
+                    SET last_accessed_at = CURRENT_TIMESTAMP,
+                        hit_count = hit_count + 1
+                    WHERE cache_key = %s
+                      AND created_at > CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                    RETURNING results,
+                              EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - created_at)) as age_seconds
+                """, (cache_key, ttl_seconds))
+                
+                result = cursor.fetchone()
+                conn.commit()
+                if not result:
+                    return None
+                return {'results': result['results'], 'age_seconds': float(result['age_seconds'])}
+                
+        finally:
+            self.release_connection(conn)
+    
+    def save_search_cache_entry(self, cache_key: str, query: str, results: List[Dict]):
+        """Insert or refresh cached search results"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO search_result_cache (cache_key, query, results)
+                    VALUES (%s, %s, %s::jsonb)
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET results = EXCLUDED.results,
+                        query = EXCLUDED.query,
+                        created_at = CURRENT_TIMESTAMP,
+                        last_accessed_at = CURRENT_TIMESTAMP
+                """, (cache_key, query, json.dumps(results)))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def evict_search_cache(self, ttl_seconds: int) -> int:
+        """Delete expired search cache entries"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM search_result_cache
+                    WHERE created_at <= CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                """, (ttl_seconds,))
+                deleted = cursor.rowcount
+                
+                conn.commit()
+                return deleted
+                
+        finally:
+            self.release_connection(conn)
+    
+    def ensure_rate_limit_bucket(self, name: str, refill_rate: float, capacity: float):
+        """Create a shared token bucket if it doesn't exist yet"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO rate_limit_buckets (name, tokens, capacity, refill_rate, updated_at)
+                    VALUES (%s, %s, %s, %s, clock_timestamp())
+                    ON CONFLICT (name) DO NOTHING
+                """, (name, capacity, capacity, refill_rate))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def reserve_rate_limit_token(self, name: str, max_wait: float) -> tuple:
+        """
+        Refill a shared token bucket and reserve one token if it is available within max_wait seconds
+        
+        The bucket may go negative: each caller is handed the next free slot and
+        sleeps until then, so concurrent workers queue rather than collide.
+        
+        Returns:
+            (granted, wait_seconds)
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    WITH bucket AS (
+                        SELECT name,
+                               LEAST(capacity, tokens + EXTRACT(EPOCH FROM (clock_timestamp() - updated_at))::float8
+                                     * refill_rate) as available,
+                               refill_rate
+                        FROM rate_limit_buckets
+                        WHERE name = %s
+                        FOR UPDATE
+                    ),
+                    slot AS (
+                        SELECT name, available, GREATEST(0, (1 - available) / refill_rate) as wait_seconds
+                        FROM bucket
+                    )
+                    UPDATE rate_limit_buckets b
+                    SET tokens = slot.available - CASE WHEN slot.wait_seconds <= %s THEN 1 ELSE 0 END,
+                        updated_at = clock_timestamp()
+                    FROM slot
+                    WHERE b.name = slot.name
+                    RETURNING slot.wait_seconds <= %s as granted, slot.wait_seconds
+                """, (name, max_wait, max_wait))
+                
+                result = cursor.fetchone()
+                conn.commit()
+                if not result:
+                    return True, 0.0
+                return result['granted'], float(result['wait_seconds'])
+                
+        finally:
+            self.release_connection(conn)
+    
+    def update_rate_limit_bucket(self, name: str, refill_rate: float, capacity: float,
+                                 quota_remaining: int = None):
+        """Change a shared bucket's rate and burst size (e.g. from provider rate limit headers)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE rate_limit_buckets
+                    SET refill_rate = %s,
+                        capacity = %s,
+                        tokens = LEAST(tokens, %s),
+                        quota_remaining = COALESCE(%s, quota_remaining)
+                    WHERE name = %s
+                """, (refill_rate, capacity, capacity, quota_remaining, name))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def pause_rate_limit_bucket(self, name: str, seconds: float):
+        """Hand out no tokens from a shared bucket for the next `seconds`"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE rate_limit_buckets
+                    SET tokens = LEAST(tokens, -(%s * refill_rate)),
+                        updated_at = clock_timestamp()
+                    WHERE name = %s
+                """, (seconds, name))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def record_job_metric(self, job_id: int, stage: str, batch_num: int = None,
+                          prompt_tokens: int = None, completion_tokens: int = None,
+                          cached_tokens: int = None, latency_ms: int = None,
+                          finish_reason: str = None, query_count: int = None,
+                          search_cache_hits: int = None, queries_saved: int = None):
+        """Record telemetry for one stage of a job (a search run or a single LLM call)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO job_metrics
+                        (job_id, stage, batch_num, prompt_tokens, completion_tokens,
+                         cached_tokens, latency_ms, finish_reason, query_count, search_cache_hits,
+                         queries_saved)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (job_id, stage, batch_num, prompt_tokens, completion_tokens,
+                      cached_tokens, latency_ms, finish_reason, query_count, search_cache_hits,
+                      queries_saved))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def get_job_metrics(self, limit: int = 50) -> List[Dict]:
+        """Get per-job telemetry totals for the most recent jobs that recorded metrics"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT 
+                        j.id as job_id,
+                        j.status,
+                        c.name as company_name,
+                        c.isin,
+                        j.started_at,
+                        j.completed_at,
+                        EXTRACT(EPOCH FROM (j.completed_at - j.started_at)) * 1000 as duration_ms,
+                        COUNT(*) FILTER (WHERE m.stage = 'llm') as llm_calls,
+                        COALESCE(SUM(m.prompt_tokens), 0) as prompt_tokens,
+                        COALESCE(SUM(m.completion_tokens), 0) as completion_tokens,
+                        COALESCE(SUM(m.cached_tokens), 0) as cached_tokens,
+                        COALESCE(SUM(m.query_count), 0) as search_queries,
+                        COALESCE(SUM(m.search_cache_hits), 0) as search_cache_hits,
+                        COALESCE(SUM(m.queries_saved), 0) as search_queries_saved,
+                        COALESCE(SUM(m.latency_ms) FILTER (WHERE m.stage = 'search'), 0) as search_ms,
+                        COALESCE(SUM(m.latency_ms) FILTER (WHERE m.stage = 'llm'), 0) as llm_ms,
+                        COUNT(*) FILTER (WHERE m.finish_reason = 'response_cache') as response_cache_hits
+                    FROM job_metrics m
+                    JOIN assessment_jobs j ON m.job_id = j.id
+                    JOIN companies c ON j.company_id = c.id
+                    GROUP BY j.id, c.name, c.isin
+                    ORDER BY MAX(m.created_at) DESC
+                    LIMIT %s
+                """, (limit,))
+                return cursor.fetchall()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def get_metrics_summary(self, hours: int = 24) -> Dict:
+        """Get p50/p95 latency per stage, job duration percentiles and token totals for a time window"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                summary = {}
+                
+                cursor.execute("""
+                    SELECT 
+                        stage,
+                        COUNT(*) as count,
+                        percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) as p50_ms,
+                        percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) as p95_ms,
+                        COALESCE(SUM(prompt_tokens), 0) as prompt_tokens,
+                        COALESCE(SUM(completion_tokens), 0) as completion_tokens,
+                        COALESCE(SUM(cached_tokens), 0) as cached_tokens,
+                        COALESCE(SUM(query_count), 0) as search_queries,
+                        COALESCE(SUM(search_cache_hits), 0) as search_cache_hits,
+                        COALESCE(SUM(queries_saved), 0) as search_queries_saved
+                    FROM job_metrics
+                    WHERE created_at > CURRENT_TIMESTAMP - (%s * INTERVAL '1 hour')
+                    GROUP BY stage
+                    ORDER BY stage
+                """, (hours,))
+                summary['stages'] = cursor.fetchall()
+                
+                cursor.execute("""
+                    SELECT 
+                        COUNT(*) as jobs,
+                        COUNT(DISTINCT company_id) as companies,
+                        percentile_cont(0.5) WITHIN GROUP (
+                            ORDER BY EXTRACT(EPOCH FROM (completed_at - started_at)) * 1000
+                        ) as p50_ms,
+                        percentile_cont(0.95) WITHIN GROUP (
+                            ORDER BY EXTRACT(EPOCH FROM (completed_at - started_at)) * 1000
+                        ) as p95_ms
+                    FROM assessment_jobs
+                    WHERE status = 'completed'
+                      AND completed_at > CURRENT_TIMESTAMP - (%s * INTERVAL '1 hour')
+                """, (hours,))
+                summary['jobs'] = cursor.fetchone()
+                
+                return summary
+                
+        finally:
+            self.release_connection(conn)
+    
+    def record_worker_heartbeat(self, worker_id: str, concurrency: int, in_flight: int):
+        """Register a worker as alive (upsert)"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO worker_heartbeats (worker_id, concurrency, in_flight)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (worker_id) DO UPDATE
+                    SET concurrency = EXCLUDED.concurrency,
+                        in_flight = EXCLUDED.in_flight,
+                        last_seen_at = CURRENT_TIMESTAMP
+                """, (worker_id, concurrency, in_flight))
+                
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def remove_worker_heartbeat(self, worker_id: str):
+        """Deregister a worker on clean shutdown"""
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM worker_heartbeats WHERE worker_id = %s", (worker_id,))
+                conn.commit()
+                
+        finally:
+            self.release_connection(conn)
+    
+    def get_queue_metrics(self, live_worker_seconds: int = 90) -> Dict:
+        """
+        Get queue depth, age, throughput and worker capacity
+        
+        Pending counts use the partial pending index, throughput the completed_at
+        index (last hour only), so this is cheap enough to poll every few seconds.
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                metrics = {}
+                
+                cursor.execute("""
+                    SELECT 
+                        COALESCE(lane, 'bulk') as lane,
+                        COALESCE(stage, 'retrieval') as stage,
+                        COUNT(*) as pending,
+                        COUNT(*) FILTER (WHERE run_after > CURRENT_TIMESTAMP) as deferred,
+                        EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - MIN(created_at))) as oldest_age_seconds
+                    FROM assessment_jobs
+                    WHERE status = 'pending'
+                    GROUP BY 1, 2
+                    ORDER BY 1, 2
+                """)
+                metrics['pending'] = cursor.fetchall()
+                
+                cursor.execute("""
+                    SELECT COALESCE(stage, 'retrieval') as stage, COUNT(*) as processing
+                    FROM assessment_jobs
+                    WHERE status = 'processing'
+                    GROUP BY 1
+                    ORDER BY 1
+                """)
+                metrics['processing'] = cursor.fetchall()
+                
+                cursor.execute("""
+                    SELECT 
+                        COUNT(*) FILTER (WHERE status = 'completed'
+                                         AND completed_at > CURRENT_TIMESTAMP - INTERVAL '1 minute') as completed_1m,
+                        COUNT(*) FILTER (WHERE status = 'completed'
+                                         AND completed_at > CURRENT_TIMESTAMP - INTERVAL '5 minutes') as completed_5m,
+                        COUNT(*) FILTER (WHERE status = 'completed'
+                                         AND completed_at > CURRENT_TIMESTAMP - INTERVAL '15 minutes') as completed_15m,
+                        COUNT(*) FILTER (WHERE status = 'completed') as completed_60m,
+                        COUNT(*) FILTER (WHERE status = 'failed') as failed_60m,
+                        AVG(EXTRACT(EPOCH FROM (completed_at - started_at)))
+                            FILTER (WHERE status = 'completed') as avg_duration_seconds
+                    FROM assessment_jobs
+                    WHERE completed_at > CURRENT_TIMESTAMP - INTERVAL '60 minutes'
+                      AND status IN ('completed', 'failed')
+                """)
+                metrics['throughput'] = cursor.fetchone()
+                
+                cursor.execute("""
+                    SELECT 
+                        COUNT(*) as live_workers,
+                        COALESCE(SUM(concurrency), 0) as capacity,
+                        COALESCE(SUM(in_flight), 0) as in_flight
+                    FROM worker_heartbeats
+                    WHERE last_seen_at > CURRENT_TIMESTAMP - (%s * INTERVAL '1 second')
+                """, (live_worker_seconds,))
+                metrics['workers'] = cursor.fetchone()
+                
+                return metrics
+                
+        finally:
+            self.release_connection(conn)
+    
     def get_stats(self) -> Dict:
         """Get system statistics"""
         conn = self.get_connection()
@@ -371,6 +1432,7 @@ class Database:
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 file_size = len(content.encode('utf-8'))
+                section_index = build_section_index(content)
                 
                 # If set_active, deactivate all others first
                 if set_active:
@@ -378,10 +1440,10 @@ class Database:
                 
                 cursor.execute("""
                     INSERT INTO processprompt_versions 
-                    (version_name, content, file_size, notes, is_active)
-                    VALUES (%s, %s, %s, %s, %s)
+                    (version_name, content, file_size, notes, is_active, section_index)
+                    VALUES (%s, %s, %s, %s, %s, %s)
                     RETURNING id
-                """, (version_name, content, file_size, notes, set_active))
+                """, (version_name, content, file_size, notes, set_active, json.dumps(section_index)))
                 
                 processprompt_id = cursor.fetchone()['id']
                 conn.commit()
@@ -412,6 +1474,16 @@ class Database:
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
+                # Index versions uploaded before section indexing existed
+                cursor.execute("""
+                    SELECT content, section_index FROM processprompt_versions WHERE id = %s
+                """, (processprompt_id,))
+                row = cursor.fetchone()
+                if row and not is_usable(row[1]):
+                    cursor.execute("""
+                        UPDATE processprompt_versions SET section_index = %s WHERE id = %s
+                    """, (json.dumps(build_section_index(row[0])), processprompt_id))
+                
                 # Deactivate all
                 cursor.execute("UPDATE processprompt_versions SET is_active = FALSE")
                 
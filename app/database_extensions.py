@@ -6,6 +6,8 @@ from typing import Optional, Dict, List
 from psycopg2.extras import RealDictCursor
 import logging
 
+from app.database import JOB_CHANNEL, LANE_BULK
+
 logger = logging.getLogger(__name__)
 
 def add_sync_methods_to_database(Database):
@@ -111,18 +113,20 @@ def add_sync_methods_to_database(Database):
         finally:
             self.release_connection(conn)
     
-    def create_assessment_job(self, company_id: int) -> int:
-        """Create assessment job for a company"""
+    def create_assessment_job(self, company_id: int, lane: str = LANE_BULK,
+                              priority: int = 0, batch_id: str = None) -> int:
+        """Create assessment job for a company (bulk lane by default)"""
         conn = self.get_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    INSERT INTO assessment_jobs (company_id, status)
-                    VALUES (%s, 'pending')
+                    INSERT INTO assessment_jobs (company_id, status, lane, priority, batch_id)
+                    VALUES (%s, 'pending', %s, %s, %s)
                     RETURNING id
-                """, (company_id,))
+                """, (company_id, lane, priority, batch_id))
                 
                 job_id = cursor.fetchone()['id']
+                cursor.execute("SELECT pg_notify(%s, %s)", (JOB_CHANNEL, str(job_id)))
                 conn.commit()
                 return job_id
         finally:
@@ -0,0 +1,160 @@
+"""
+Search Result De-duplication
+Canonicalizes URLs and clusters near-duplicate results (SimHash over title and
+description) so mirrored or re-syndicated documents reach the prompt only once
+"""
+import os
+import re
+import hashlib
+import logging
+from typing import Callable, Dict, List
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only track the click, never change the document
+TRACKING_PARAMS = {
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+    '_hsenc', '_hsmi', 'ref', 'ref_src', 'src', 'cmpid', 'spm', 'sessionid'
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_', 'hsa_')
+
+SIMHASH_BITS = 64
+YEAR_PATTERN = re.compile(r'\b(?:19|20)\d{2}\b')
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonical form of a URL for de-duplication (not for fetching)
+
+    Scheme-, 'www.'-, case- and default-port-insensitive; drops fragments,
+    tracking parameters and trailing slashes; sorts the remaining parameters.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url
+
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r'/{2,}', '/', parts.path or '/')
+    if len(path) > 1:
+        path = path.rstrip('/')
+    if path.lower().endswith(('.pdf', '.htm', '.html')):
+        # File names on static hosts and CDNs are case-insensitive in practice
+        path = path.lower()
+
+    params = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    ]
+    query = urlencode(sorted(params))
+
+    return urlunsplit(('https', host, path, query, ''))
+
+
+def _features(text: str) -> List[str]:
+    """Word unigrams and bigrams of normalized text"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash (md5-based, so stable across processes unlike hash())"""
+    weights = [0] * SIMHASH_BITS
+    for feature in _features(text):
+        h = int.from_bytes(hashlib.md5(feature.encode('utf-8')).digest()[:8], 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateClusterer:
+    """
+    Groups search results whose title + description are near-identical
+
+    Settings (env-configurable):
+        SEARCH_SIMHASH_DISTANCE  - max differing SimHash bits for a near-duplicate (0 disables)
+        SEARCH_SIMHASH_MIN_WORDS - snippets shorter than this are never clustered
+                                   (short generic titles collide too easily)
+    """
+
+    def __init__(self, max_distance: int = None, min_words: int = None):
+        self.max_distance = max_distance if max_distance is not None else \
+            int(os.getenv('SEARCH_SIMHASH_DISTANCE', '3'))
+        self.min_words = min_words if min_words is not None else \
+            int(os.getenv('SEARCH_SIMHASH_MIN_WORDS', '8'))
+
+    def deduplicate(self, documents: List[Dict], score_fn: Callable[[Dict], float]) -> List[Dict]:
+        """
+        Keep one representative per near-duplicate cluster
+
+        The representative is the highest-scoring document (ties: shortest, then
+        lexically first canonical URL); it carries the other members' URLs in
+        'duplicate_urls'. Input order is preserved otherwise.
+        """
+        if self.max_distance <= 0 or len(documents) < 2:
+            return documents
+
+        fingerprints = []
+        for doc in documents:
+            text = f"{doc.get('title', '')} {doc.get('description', '')}"
+            if len(TOKEN_PATTERN.findall(text.lower())) < self.min_words:
+                fingerprints.append(None)
+            else:
+                fingerprints.append((simhash(text), frozenset(YEAR_PATTERN.findall(text))))
+
+        # Union-find over pairs within max_distance (n is at most a few hundred)
+        parent = list(range(len(documents)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, fp_i in enumerate(fingerprints):
+            if fp_i is None:
+                continue
+            for j in range(i + 1, len(documents)):
+                fp_j = fingerprints[j]
+                if fp_j is None:
+                    continue
+                # Different report years are different documents, however similar the text
+                if fp_i[1] and fp_j[1] and fp_i[1] != fp_j[1]:
+                    continue
+                if hamming_distance(fp_i[0], fp_j[0]) <= self.max_distance:
+                    parent[find(j)] = find(i)
+
+        clusters: Dict[int, List[int]] = {}
+        for i in range(len(documents)):
+            clusters.setdefault(find(i), []).append(i)
+
+        keep = {}
+        for members in clusters.values():
+            best = min(members, key=lambda i: (-score_fn(documents[i]),
+                                               len(canonicalize_url(documents[i].get('url', ''))),
+                                               canonicalize_url(documents[i].get('url', ''))))
+            representative = documents[best]
+            if len(members) > 1:
+                representative = {
+                    **representative,
+                    'duplicate_urls': [documents[i].get('url', '') for i in members if i != best]
+                }
+            keep[best] = representative
+
+        return [keep[i] for i in sorted(keep)]
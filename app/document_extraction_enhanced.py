@@ -8,13 +8,14 @@ Implements Priority 1-2 improvements:
 - Year-range searching
 """
 
-import requests
 import re
 import logging
 from typing import List, Dict, Optional, Tuple
 from urllib.parse import urlparse, quote
 import time
 
+from app import http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,10 +24,9 @@ class EnhancedDocumentExtractor:
     
     def __init__(self, serpapi_key: str):
         self.serpapi_key = serpapi_key
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        }
     
     def infer_company_domain(self, company_name: str) -> Optional[str]:
         """Infer company domain from company name"""
@@ -125,7 +125,7 @@ class EnhancedDocumentExtractor:
         """Try to access a URL directly and extract content"""
         try:
             # First check if URL exists (HEAD request)
-            head_resp = self.session.head(url, timeout=5, allow_redirects=True)
+            head_resp = http_client.request('HEAD', url, headers=self.headers, timeout=5)
             
             if head_resp.status_code == 200:
                 logger.info(f"✓ Found direct URL: {url}")
@@ -150,9 +150,9 @@ class EnhancedDocumentExtractor:
         try:
             jina_url = f"https://r.jina.ai/{url}"
             
-            response = self.session.get(
+            response = http_client.get(
                 jina_url,
-                headers={'Accept': 'application/json'},
+                headers={**self.headers, 'Accept': 'application/json'},
                 timeout=30
             )
             
@@ -219,7 +219,7 @@ class EnhancedDocumentExtractor:
                 'num': num_results
             }
             
-            response = requests.get(url, params=params, timeout=15)
+            response = http_client.get(url, params=params, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
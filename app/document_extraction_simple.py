@@ -3,9 +3,10 @@ Simple Document Extraction - Using Jina AI Reader API
 No external dependencies required - works with any URL including PDFs
 """
 import logging
-import requests
 from typing import List, Dict, Optional
 
+from app import http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,7 +27,7 @@ def extract_text_from_url(url: str) -> Optional[Dict]:
         
         logger.info(f"Extracting text from: {url}")
         
-        response = requests.get(
+        response = http_client.get(
             reader_url,
             headers={'Accept': 'application/json'},
             timeout=30
@@ -15,13 +15,14 @@ Priority 2:
 Expected impact: 20% → 60-70% evidence discovery
 """
 
-import requests
 import re
 import logging
 from typing import List, Dict, Optional, Tuple
 from urllib.parse import urlparse, quote
 import time
 
+from app import http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,10 +31,9 @@ class DocumentExtractorV3:
     
     def __init__(self, serpapi_key: str):
         self.serpapi_key = serpapi_key
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        }
     
     def infer_company_domain(self, company_name: str) -> Optional[str]:
         """Infer company domain from company name"""
@@ -74,9 +74,9 @@ class DocumentExtractorV3:
         try:
             jina_url = f"https://r.jina.ai/{url}"
             
-            response = self.session.get(
+            response = http_client.get(
                 jina_url,
-                headers={'Accept': 'application/json'},
+                headers={**self.headers, 'Accept': 'application/json'},
                 timeout=30
             )
             
@@ -104,7 +104,7 @@ class DocumentExtractorV3:
                 'num': num_results
             }
             
-            response = requests.get(url, params=params, timeout=15)
+            response = http_client.get(url, params=params, timeout=15)
             
             if response.status_code == 200:
                 data = response.json()
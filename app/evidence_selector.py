@@ -0,0 +1,116 @@
+"""
+Per-Batch Evidence Selection
+Picks the search results most relevant to a batch's measures, within a token
+budget, so each DeepSeek call only carries the sources it needs
+"""
+import os
+import re
+import logging
+from typing import Callable, Dict, List
+
+from app.document_ranker import DocumentRanker
+from app.measure_specific_prompts import get_measure_guidance
+
+logger = logging.getLogger(__name__)
+
+# Weight of one measure keyword match relative to DocumentRanker base scores
+KEYWORD_MATCH_WEIGHT = 40
+
+# Words too generic to discriminate between measures
+NAME_STOPWORDS = {
+    'and', 'or', 'of', 'for', 'the', 'to', 'in', 'with', 'other',
+    'physical', 'climate', 'risk', 'risks', 'assessment'
+}
+
+
+class EvidenceSelector:
+    """Selects top sources per batch, giving every measure in the batch a fair share"""
+
+    def __init__(self, measure_names: Dict[str, str], token_budget: int = None):
+        self.measure_names = measure_names
+        self.token_budget = token_budget or int(os.getenv('EVIDENCE_TOKENS_PER_BATCH', '4000'))
+        self.ranker = DocumentRanker()
+
+    def measure_keywords(self, measure_id: str) -> List[str]:
+        """Keywords for a measure: ranker category, measure-specific guidance and name terms"""
+        keywords = list(self.ranker.MEASURE_KEYWORDS.get(self.ranker.get_measure_category(measure_id), []))
+        keywords.extend(get_measure_guidance(measure_id).get('search_keywords', []))
+
+        name = self.measure_names.get(measure_id, '').lower()
+        keywords.extend(
+            word for word in re.findall(r'[a-z][a-z-]+', name)
+            if word not in NAME_STOPWORDS and len(word) > 3
+        )
+
+        # De-duplicate, keep order
+        return list(dict.fromkeys(kw.lower() for kw in keywords))
+
+    def select(self, documents: List[Dict], measure_ids: List[str],
+               cost_fn: Callable[[Dict], int]) -> List[Dict]:
+        """
+        Select sources for a batch
+
+        Each measure ranks all documents by keyword matches plus the base
+        DocumentRanker relevance score; measures then take turns picking their
+        next-best unselected document that still fits, until the token budget is
+        spent or no remaining document fits.
+
+        Args:
+            documents: Candidate documents (already in deterministic order)
+            measure_ids: Measures in this batch
+            cost_fn: Prompt tokens a document costs when formatted
+
+        Returns:
+            Selected documents, in their original order
+        """
+        if not documents:
+            return []
+
+        base_scores = [self.ranker._calculate_relevance_score(doc) for doc in documents]
+        texts = [
+            f"{doc.get('title', '')} {doc.get('description', '')} {doc.get('url', '')}".lower()
+            for doc in documents
+        ]
+
+        rankings = []
+        for measure_id in measure_ids:
+            keywords = self.measure_keywords(measure_id)
+            scores = [
+                base_scores[i] + KEYWORD_MATCH_WEIGHT * sum(1 for kw in keywords if kw in texts[i])
+                for i in range(len(documents))
+            ]
+            # Stable tie-break on original position keeps selection deterministic
+            rankings.append(sorted(range(len(documents)), key=lambda i: (-scores[i], i)))
+
+        selected = set()
+        too_large = set()  # Documents that no longer fit; the budget only shrinks
+        costs = {}
+        used_tokens = 0
+        cursors = [0] * len(rankings)
+
+        while used_tokens < self.token_budget:
+            progressed = False
+            for r, ranking in enumerate(rankings):
+                # Next-best document for this measure that is unselected and still fits
+                while cursors[r] < len(ranking):
+                    index = ranking[cursors[r]]
+                    if index in selected or index in too_large:
+                        cursors[r] += 1
+                        continue
+                    if index not in costs:
+                        costs[index] = cost_fn(documents[index])
+                    cost = costs[index]
+                    if used_tokens + cost > self.token_budget:
+                        too_large.add(index)
+                        cursors[r] += 1
+                        continue
+                    selected.add(index)
+                    used_tokens += cost
+                    progressed = True
+                    break
+            if not progressed:
+                break
+
+        logger.info(f"Selected {len(selected)}/{len(documents)} sources "
+                    f"({used_tokens} tokens) for {', '.join(measure_ids)}")
+        return [documents[i] for i in sorted(selected)]
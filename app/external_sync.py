@@ -2,14 +2,26 @@
 External Spreadsheet Sync Module
 Handles importing companies from external API
 """
-import requests
 import logging
+from datetime import datetime
 from typing import List, Dict, Optional
 
+from app import http_client
+
 logger = logging.getLogger(__name__)
 
 EXTERNAL_API_URL = "https://climaterisk-rur7xaeu.manus.space/api/trpc/companies.list"
 
+def _companies_from_response(data: Dict) -> Optional[List[Dict]]:
+    """Extract companies from the tRPC response structure"""
+    if 'result' in data and 'data' in data['result'] and 'json' in data['result']['data']:
+        companies = data['result']['data']['json']
+        logger.info(f"Successfully fetched {len(companies)} companies from API")
+        return companies
+    else:
+        logger.error("Unexpected API response structure")
+        return None
+
 def fetch_external_companies() -> Optional[List[Dict]]:
     """
     Fetch company list from external tRPC API
@@ -20,19 +32,24 @@ def fetch_external_companies() -> Optional[List[Dict]]:
     try:
         logger.info(f"Fetching companies from {EXTERNAL_API_URL}")
         
-        response = requests.get(EXTERNAL_API_URL, timeout=30)
+        response = http_client.get(EXTERNAL_API_URL, timeout=30)
         response.raise_for_status()
         
-        data = response.json()
+        return _companies_from_response(response.json())
         
-        # Extract companies from tRPC response structure
-        if 'result' in data and 'data' in data['result'] and 'json' in data['result']['data']:
-            companies = data['result']['data']['json']
-            logger.info(f"Successfully fetched {len(companies)} companies from API")
-            return companies
-        else:
-            logger.error("Unexpected API response structure")
-            return None
+    except Exception as e:
+        logger.error(f"Failed to fetch companies from API: {e}")
+        return None
+
+async def fetch_external_companies_async() -> Optional[List[Dict]]:
+    """Async version of fetch_external_companies (doesn't block the web app's event loop)"""
+    try:
+        logger.info(f"Fetching companies from {EXTERNAL_API_URL}")
+        
+        response = await http_client.async_get(EXTERNAL_API_URL, timeout=30)
+        response.raise_for_status()
+        
+        return _companies_from_response(response.json())
         
     except Exception as e:
         logger.error(f"Failed to fetch companies from API: {e}")
@@ -73,12 +90,15 @@ def parse_companies_from_api(api_companies: List[Dict]) -> List[Dict]:
     logger.info(f"Parsed {len(companies)} valid companies from API")
     return companies
 
-def sync_companies_from_external(db) -> Dict:
+_NOT_FETCHED = object()
+
+def sync_companies_from_external(db, api_companies=_NOT_FETCHED) -> Dict:
     """
     Sync companies from external API to database
     
     Args:
         db: Database instance
+        api_companies: Result of an earlier fetch (None if it failed); fetched here if not given
         
     Returns:
         Dictionary with sync results (added, updated, skipped, errors)
@@ -95,7 +115,8 @@ def sync_companies_from_external(db) -> Dict:
     
     try:
         # Fetch companies from API
-        api_companies = fetch_external_companies()
+        if api_companies is _NOT_FETCHED:
+            api_companies = fetch_external_companies()
         if api_companies is None:
             results['message'] = "Failed to fetch companies from API"
             return results
@@ -169,6 +190,9 @@ def submit_assessments_for_companies(db, company_isins: List[str] = None) -> Dic
         'message': ''
     }
     
+    # Jobs from one submission share a batch id so concurrent syncs/uploads take turns
+    batch_id = f"sync-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+    
     try:
         # Get companies to assess
         if company_isins:
@@ -194,7 +218,7 @@ def submit_assessments_for_companies(db, company_isins: List[str] = None) -> Dic
                     continue
                 
                 # Submit new job
-                job_id = db.create_assessment_job(company['id'])
+                job_id = db.create_assessment_job(company['id'], batch_id=batch_id)
                 results['submitted'] += 1
                 logger.info(f"Submitted assessment job for {company['name']} (Job ID: {job_id})")
                 
@@ -0,0 +1,141 @@
+"""
+Shared HTTP Client
+One pooled, keep-alive httpx client per process for all outbound calls
+(Brave, Jina Reader, the external company API), with HTTP/2 when available,
+per-host connection limits and default timeouts
+"""
+import os
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_async_host_slots: Dict[str, asyncio.Semaphore] = {}
+_client_lock = threading.Lock()
+
+
+def _client_settings() -> Dict:
+    """
+    Client settings (env-configurable):
+        HTTP_POOL_SIZE          - max open connections across all hosts
+        HTTP_MAX_KEEPALIVE      - idle connections kept open for reuse
+        HTTP_KEEPALIVE_EXPIRY   - seconds an idle connection is kept
+        HTTP_CONNECT_TIMEOUT    - seconds to establish a connection
+        HTTP_TIMEOUT            - default read/write/pool timeout in seconds
+        HTTP2                   - 'true' to negotiate HTTP/2 (requires h2)
+    """
+    use_http2 = os.getenv('HTTP2', 'true').lower() == 'true'
+    if use_http2 and not HTTP2_AVAILABLE:
+        logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+        use_http2 = False
+
+    return {
+        'http2': use_http2,
+        'limits': httpx.Limits(
+            max_connections=int(os.getenv('HTTP_POOL_SIZE', '100')),
+            max_keepalive_connections=int(os.getenv('HTTP_MAX_KEEPALIVE', '20')),
+            keepalive_expiry=float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+        ),
+        'timeout': httpx.Timeout(
+            float(os.getenv('HTTP_TIMEOUT', '30')),
+            connect=float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+        ),
+        # Match requests' behaviour - report URLs and portals redirect a lot
+        'follow_redirects': True
+    }
+
+
+def get_http_client() -> httpx.Client:
+    """Get or create the process-wide sync HTTP client"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            settings = _client_settings()
+            _client = httpx.Client(**settings)
+            logger.info(f"HTTP client created (http2={settings['http2']}, "
+                        f"max_connections={settings['limits'].max_connections})")
+        return _client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Get or create the process-wide async HTTP client (for the web app's event loop)"""
+    global _async_client
+    with _client_lock:
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(**_client_settings())
+        return _async_client
+
+
+def _max_per_host() -> int:
+    return int(os.getenv('HTTP_MAX_PER_HOST', '10'))
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = urlsplit(url).netloc
+    with _client_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(_max_per_host())
+        return _host_slots[host]
+
+
+def _async_host_slot(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    if host not in _async_host_slots:
+        _async_host_slots[host] = asyncio.Semaphore(_max_per_host())
+    return _async_host_slots[host]
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request on the shared client, waiting for a per-host slot (HTTP_MAX_PER_HOST)
+
+    Accepts httpx request arguments (params, headers, json, timeout, ...).
+    """
+    with _host_slot(url):
+        return get_http_client().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request('GET', url, **kwargs)
+
+
+async def async_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Async counterpart of request()"""
+    async with _async_host_slot(url):
+        return await get_async_http_client().request(method, url, **kwargs)
+
+
+async def async_get(url: str, **kwargs) -> httpx.Response:
+    return await async_request('GET', url, **kwargs)
+
+
+def close_http_client():
+    """Close the sync client's pooled connections (on worker shutdown)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def aclose_async_http_client():
+    """Close the async client's pooled connections (on web app shutdown)"""
+    global _async_client
+    with _client_lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,47 @@
+"""
+Job Cost Model
+Turns recorded token and search-query counts into USD cost estimates
+"""
+import os
+from typing import Dict
+
+
+class CostModel:
+    """
+    Prices (USD, env-configurable):
+        DEEPSEEK_PRICE_INPUT_MISS_PER_M  - prompt tokens not served from DeepSeek's context cache
+        DEEPSEEK_PRICE_INPUT_HIT_PER_M   - prompt tokens served from the context cache
+        DEEPSEEK_PRICE_OUTPUT_PER_M      - completion tokens
+        BRAVE_PRICE_PER_QUERY            - one Brave Search API request
+    """
+
+    def __init__(self):
+        self.input_miss_per_m = float(os.getenv('DEEPSEEK_PRICE_INPUT_MISS_PER_M', '0.27'))
+        self.input_hit_per_m = float(os.getenv('DEEPSEEK_PRICE_INPUT_HIT_PER_M', '0.07'))
+        self.output_per_m = float(os.getenv('DEEPSEEK_PRICE_OUTPUT_PER_M', '1.10'))
+        self.search_per_query = float(os.getenv('BRAVE_PRICE_PER_QUERY', '0.005'))
+
+    def llm_cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+        prompt_tokens = prompt_tokens or 0
+        cached_tokens = min(cached_tokens or 0, prompt_tokens)
+        return (
+            (prompt_tokens - cached_tokens) * self.input_miss_per_m
+            + cached_tokens * self.input_hit_per_m
+            + (completion_tokens or 0) * self.output_per_m
+        ) / 1_000_000
+
+    def search_cost(self, search_queries: int) -> float:
+        return (search_queries or 0) * self.search_per_query
+
+    def annotate(self, row: Dict) -> Dict:
+        """Add llm/search/total cost fields to a row of token and query totals"""
+        llm_cost = self.llm_cost(int(row.get('prompt_tokens') or 0),
+                                 int(row.get('completion_tokens') or 0),
+                                 int(row.get('cached_tokens') or 0))
+        search_cost = self.search_cost(int(row.get('search_queries') or 0))
+        row['llm_cost_usd'] = round(llm_cost, 6)
+        row['search_cost_usd'] = round(search_cost, 6)
+        row['total_cost_usd'] = round(llm_cost + search_cost, 6)
+        if 'search_queries_saved' in row:
+            row['search_savings_usd'] = round(self.search_cost(int(row['search_queries_saved'] or 0)), 6)
+        return row
@@ -0,0 +1,146 @@
+"""
+LLM Response Cache
+Caches DeepSeek responses keyed by a hash of the full request so that
+deterministic (temperature=0) re-runs with unchanged evidence cost nothing
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model: str, system_message: str, prompt: str, max_tokens: int) -> str:
+    """Hash everything that determines the response"""
+    payload = json.dumps([model, system_message, prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Response cache with TTL and size-bounded (LRU) eviction
+
+    Backends (LLM_CACHE_BACKEND):
+        postgres - llm_response_cache table, shared by all workers (default)
+        disk     - one JSON file per entry under LLM_CACHE_DIR, local to the worker
+        off      - caching disabled
+    """
+
+    def __init__(self, db=None):
+        self.backend = os.getenv('LLM_CACHE_BACKEND', 'postgres').lower()
+        self.ttl_seconds = int(float(os.getenv('LLM_CACHE_TTL_HOURS', '720')) * 3600)
+        self.max_bytes = int(float(os.getenv('LLM_CACHE_MAX_MB', '500')) * 1024 * 1024)
+        self.cache_dir = os.getenv('LLM_CACHE_DIR', '/tmp/llm_cache')
+        self.evict_interval = int(os.getenv('LLM_CACHE_EVICT_INTERVAL', '600'))
+        self.db = db
+        self._evict_lock = threading.Lock()
+        self._last_evicted = 0.0
+
+        if self.backend == 'postgres' and self.db is None:
+            logger.warning("LLM cache backend 'postgres' requires a database, disabling cache")
+            self.backend = 'off'
+
+        if self.backend == 'disk':
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        logger.info(f"LLM response cache: backend={self.backend}, ttl={self.ttl_seconds}s, "
+                    f"max={self.max_bytes} bytes")
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend in ('postgres', 'disk')
+
+    def get(self, cache_key: str) -> Optional[str]:
+        """Return cached response or None (cache failures are treated as misses)"""
+        if not self.enabled:
+            return None
+
+        try:
+            if self.backend == 'postgres':
+                return self.db.get_llm_cache_entry(cache_key, self.ttl_seconds)
+            return self._disk_get(cache_key)
+        except Exception as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    def set(self, cache_key: str, model: str, response: str):
+        """Store response and run eviction (cache failures never fail the caller)"""
+        if not self.enabled:
+            return
+
+        try:
+            if self.backend == 'postgres':
+                self.db.save_llm_cache_entry(cache_key, model, response)
+            else:
+                self._disk_set(cache_key, model, response)
+            self._maybe_evict()
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+    def _maybe_evict(self):
+        """Run eviction at most once per evict_interval per process (it scans the whole cache)"""
+        with self._evict_lock:
+            now = time.time()
+            if now - self._last_evicted < self.evict_interval:
+                return
+            self._last_evicted = now
+
+        if self.backend == 'postgres':
+            deleted = self.db.evict_llm_cache(self.ttl_seconds, self.max_bytes)
+            if deleted:
+                logger.info(f"Evicted {deleted} LLM cache entries")
+        else:
+            self._disk_evict()
+
+    def _disk_path(self, cache_key: str) -> str:
+        return os.path.join(self.cache_dir, f"{cache_key}.json")
+
+    def _disk_get(self, cache_key: str) -> Optional[str]:
+        path = self._disk_path(cache_key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+
+        if time.time() - entry['created_at'] > self.ttl_seconds:
+            os.remove(path)
+            return None
+
+        # Touch for LRU ordering
+        os.utime(path, None)
+        return entry['response']
+
+    def _disk_set(self, cache_key: str, model: str, response: str):
+        path = self._disk_path(cache_key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': model, 'response': response, 'created_at': time.time()}, f)
+        os.replace(tmp_path, path)
+
+    def _disk_evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Most recently used first; drop everything past the size budget
+        entries.sort(reverse=True)
+        total = 0
+        for _, size, path in entries:
+            total += size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
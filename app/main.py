@@ -12,9 +12,13 @@ from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
 from datetime import datetime
 
-from app.database import Database, init_database
+from app.database import Database, init_database, LANE_BULK
 from app.database_extensions import add_sync_methods_to_database
-from app.external_sync import sync_companies_from_external, submit_assessments_for_companies
+from app.external_sync import (
+    sync_companies_from_external, submit_assessments_for_companies, fetch_external_companies_async
+)
+from app.http_client import aclose_async_http_client
+from app.job_metrics import CostModel
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -50,6 +54,11 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled outbound HTTP connections"""
+    await aclose_async_http_client()
+
 def build_html_page():
     """Build the HTML page dynamically"""
     db = Database()
@@ -723,7 +732,12 @@ async def submit_single(data: dict):
             country=data.get('country')
         )
         
-        job_id = db.create_job(company_id)
+        job_id = db.create_job(
+            company_id,
+            bypass_llm_cache=bool(data.get('bypass_cache', False)),
+            priority=int(data.get('priority', 0)),
+            batch_id=data.get('submitter')
+        )
         
         return {
             "success": True,
@@ -753,6 +767,7 @@ async def upload_batch(file: UploadFile = File(...)):
         
         db = Database()
         jobs_created = []
+        batch_id = f"upload-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
         
         # Process each row
         for _, row in df.iterrows():
@@ -764,7 +779,7 @@ async def upload_batch(file: UploadFile = File(...)):
                 country=row.get('Country')
             )
             
-            job_id = db.create_job(company_id)
+            job_id = db.create_job(company_id, lane=LANE_BULK, batch_id=batch_id)
             jobs_created.append(job_id)
         
         return {
@@ -919,7 +934,8 @@ async def sync_from_external():
     """Sync companies from external spreadsheet"""
     try:
         db = Database()
-        results = sync_companies_from_external(db)
+        api_companies = await fetch_external_companies_async()
+        results = sync_companies_from_external(db, api_companies)
         return results
     except Exception as e:
         logger.error(f"External sync failed: {e}")
@@ -943,7 +959,8 @@ async def full_sync_and_submit():
         db = Database()
         
         # Step 1: Sync companies
-        sync_results = sync_companies_from_external(db)
+        api_companies = await fetch_external_companies_async()
+        sync_results = sync_companies_from_external(db, api_companies)
         if not sync_results['success']:
             return {
                 'success': False,
@@ -975,6 +992,129 @@ async def get_recent_jobs():
         logger.error(f"Get recent jobs failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/jobs/{job_id}/progress")
+async def get_job_progress(job_id: int):
+    """Get job status and measures completed so far (streamed partial results)"""
+    try:
+        db = Database()
+        progress = db.get_job_progress(job_id)
+        
+        if not progress:
+            raise HTTPException(status_code=404, detail="Job not found")
+        
+        progress['measures_completed'] = len(progress['partial_measures'])
+        return progress
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get job progress failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/metrics/jobs")
+async def get_job_metrics(limit: int = 50):
+    """Get per-job tokens, latency per stage, search queries and estimated cost"""
+    try:
+        db = Database()
+        cost_model = CostModel()
+        return [cost_model.annotate(row) for row in db.get_job_metrics(limit=limit)]
+
+    except Exception as e:
+        logger.error(f"Get job metrics failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/metrics/summary")
+async def get_metrics_summary(hours: int = 24):
+    """Get p50/p95 latency per stage, job duration percentiles and cost per company"""
+    try:
+        db = Database()
+        cost_model = CostModel()
+        summary = db.get_metrics_summary(hours=hours)
+
+        totals = {'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'search_queries': 0,
+                  'search_cache_hits': 0, 'search_queries_saved': 0}
+        for stage in summary['stages']:
+            cost_model.annotate(stage)
+            for key in totals:
+                totals[key] += int(stage[key] or 0)
+        cost_model.annotate(totals)
+
+        companies = summary['jobs']['companies'] or 0
+        totals['cost_per_company_usd'] = round(totals['total_cost_usd'] / companies, 6) if companies else None
+
+        return {
+            'window_hours': hours,
+            'stages': summary['stages'],
+            'jobs': summary['jobs'],
+            'totals': totals
+        }
+
+    except Exception as e:
+        logger.error(f"Get metrics summary failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/queue/metrics")
+async def get_queue_metrics():
+    """Get queue depth per lane, oldest pending age, throughput, live workers and drain ETA (autoscaling signal)"""
+    try:
+        db = Database()
+        heartbeat_interval = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '30'))
+        metrics = db.get_queue_metrics(live_worker_seconds=int(heartbeat_interval * 3))
+
+        lanes = {}
+        pending_by_stage = {}
+        for row in metrics['pending']:
+            pending_by_stage[row['stage']] = pending_by_stage.get(row['stage'], 0) + row['pending']
+            lane = lanes.setdefault(row['lane'], {'pending': 0, 'deferred': 0, 'oldest_age_seconds': 0})
+            lane['pending'] += row['pending']
+            lane['deferred'] += row['deferred']
+            lane['oldest_age_seconds'] = max(lane['oldest_age_seconds'], float(row['oldest_age_seconds'] or 0))
+
+        pending_total = sum(lane['pending'] for lane in lanes.values())
+        processing_total = sum(row['processing'] for row in metrics['processing'])
+
+        throughput = metrics['throughput']
+        per_minute = {
+            '1m': float(throughput['completed_1m']),
+            '5m': throughput['completed_5m'] / 5,
+            '15m': throughput['completed_15m'] / 15,
+            '60m': throughput['completed_60m'] / 60
+        }
+
+        # Drain estimate from the most recent window that saw completions
+        rate = next((per_minute[w] for w in ('5m', '15m', '60m') if per_minute[w] > 0), 0)
+        backlog = pending_total + processing_total
+        drain_eta_seconds = round(backlog / rate * 60) if rate else None
+
+        workers = metrics['workers']
+        capacity = workers['capacity'] or 0
+
+        return {
+            'lanes': lanes,
+            'stages': {
+                'pending': pending_by_stage,
+                'processing': {row['stage']: row['processing'] for row in metrics['processing']}
+            },
+            'pending_total': pending_total,
+            'processing_total': processing_total,
+            'oldest_pending_age_seconds': max((lane['oldest_age_seconds'] for lane in lanes.values()), default=0),
+            'completed_per_minute': {window: round(value, 2) for window, value in per_minute.items()},
+            'failed_last_hour': throughput['failed_60m'],
+            'avg_duration_seconds': round(float(throughput['avg_duration_seconds']), 1)
+                if throughput['avg_duration_seconds'] is not None else None,
+            'workers': {
+                'live': workers['live_workers'],
+                'capacity': capacity,
+                'in_flight': workers['in_flight'],
+                'utilization': round(workers['in_flight'] / capacity, 2) if capacity else None
+            },
+            'drain_eta_seconds': drain_eta_seconds
+        }
+
+    except Exception as e:
+        logger.error(f"Get queue metrics failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/dashboard")
 async def dashboard():
     """Serve the visualization dashboard"""
@@ -0,0 +1,116 @@
+"""
+ProcessPrompt Section Index
+Parses a ProcessPrompt markdown document once into shared sections and a
+definition block per measure, so each batch prompt only carries the
+methodology it needs
+"""
+import re
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 2
+
+# Sections (## or ###) included in every batch prompt, in this order
+SHARED_SECTIONS = [
+    'OBJECTIVE', 'SCOPE', 'INSTRUCTIONS FOR EXECUTION', 'INPUT FORMAT', 'OUTPUT FORMAT',
+    'SCORING FRAMEWORK', 'STANDARD MEASURE NAMES REFERENCE TABLE', 'COMMON PITFALLS'
+]
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.+?)\s*$', re.MULTILINE)
+MEASURE_HEADING_RE = re.compile(r'^(M\d{2})\b')
+TITLE_WORD_RE = re.compile(r'[a-z0-9]+')
+
+# Words that say nothing about which measure a title names
+TITLE_STOPWORDS = {
+    'a', 'an', 'and', 'the', 'of', 'for', 'in', 'into', 'on', 'or', 'to', 'with', 'by', 'other',
+    'physical', 'climate', 'risk', 'assessment', 'm'
+}
+
+
+def build_section_index(content: str) -> Dict:
+    """
+    Parse ProcessPrompt markdown into a section index
+
+    Returns:
+        {'version': int, 'shared': {section name: text}, 'measures': {measure_id: text}}
+    """
+    headings = [(m.start(), len(m.group(1)), m.group(2)) for m in HEADING_RE.finditer(content)]
+
+    shared = {}
+    measures = {}
+    for i, (start, level, title) in enumerate(headings):
+        # A section runs until the next heading of the same or higher level
+        end = next((pos for pos, lvl, _ in headings[i + 1:] if lvl <= level), len(content))
+        text = content[start:end].strip()
+
+        if level in (2, 3) and title.upper() in SHARED_SECTIONS:
+            shared[title.upper()] = text
+            continue
+
+        match = MEASURE_HEADING_RE.match(title)
+        if match:
+            measure_id = match.group(1)
+            # Some measures appear twice (worked example + full definition); keep the fuller one
+            if len(text) > len(measures.get(measure_id, '')):
+                measures[measure_id] = text
+
+    logger.info(f"ProcessPrompt indexed: {len(shared)} shared sections, {len(measures)} measure definitions")
+    return {'version': INDEX_VERSION, 'shared': shared, 'measures': measures}
+
+
+def is_usable(index: Optional[Dict]) -> bool:
+    """Whether an index is current and has measure definitions to assemble from"""
+    return bool(index) and index.get('version') == INDEX_VERSION and bool(index.get('measures'))
+
+
+def render_shared(index: Dict) -> str:
+    """Shared sections in SHARED_SECTIONS order"""
+    return "\n\n".join(index['shared'][name] for name in SHARED_SECTIONS if name in index['shared'])
+
+
+def _title_words(title: str) -> set:
+    words = set()
+    for word in TITLE_WORD_RE.findall(title.lower()):
+        if len(word) > 3 and word.endswith('s'):
+            word = word[:-1]
+        if word not in TITLE_STOPWORDS and not word.isdigit():
+            words.add(word)
+    return words
+
+
+def titles_match(title: str, name: str) -> bool:
+    """Whether a definition heading and a measure name share a significant word"""
+    return bool(_title_words(title) & _title_words(name))
+
+
+def match_measure_names(index: Dict, measure_names: Dict[str, str]) -> Dict:
+    """
+    Copy of the index without definitions whose heading names a different measure
+    than measure_names (the ProcessPrompt may number its measures differently)
+
+    Dropped ids are listed under 'mismatched' and rendered without a definition.
+    """
+    measures = {}
+    mismatched = {}
+    for measure_id, text in index['measures'].items():
+        title = text.split('\n', 1)[0].lstrip('#').strip()
+        if measure_id not in measure_names or titles_match(title, measure_names[measure_id]):
+            measures[measure_id] = text
+        else:
+            mismatched[measure_id] = title
+
+    if mismatched:
+        details = "; ".join(f"{mid} {title!r} vs {measure_names[mid]!r}" for mid, title in mismatched.items())
+        logger.warning(f"ProcessPrompt definitions not used, headings don't match the measure names: {details}")
+    return {**index, 'measures': measures, 'mismatched': mismatched}
+
+
+def render_measures(index: Dict, measure_ids: List[str]) -> str:
+    """Definition blocks for the given measures (missing and mismatched ones are skipped)"""
+    missing = [mid for mid in measure_ids
+               if mid not in index['measures'] and mid not in index.get('mismatched', {})]
+    if missing:
+        logger.warning(f"No ProcessPrompt definition for {', '.join(missing)}")
+    return "\n\n".join(index['measures'][mid] for mid in measure_ids if mid in index['measures'])
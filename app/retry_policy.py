@@ -0,0 +1,228 @@
+"""
+Retry Policy Engine
+Classifies job failures, decides whether and when a failed job is retried,
+and guards external dependencies (DeepSeek, Brave) with circuit breakers
+"""
+import os
+import json
+import time
+import random
+import logging
+import threading
+from typing import Dict, Optional
+
+import httpx
+import requests
+import openai
+
+from app.brave_quota import QuotaWaitError
+
+logger = logging.getLogger(__name__)
+
+# Error classes
+RATE_LIMITED = 'rate_limited'
+TIMEOUT = 'timeout'
+SERVER_ERROR = 'server_error'
+PARSE_ERROR = 'parse_error'
+CIRCUIT_OPEN = 'circuit_open'
+QUOTA_WAIT = 'quota_wait'  # Waiting for Brave quota - not a failure of the job
+FATAL = 'fatal'
+
+# Errors worth recording against a dependency's circuit breaker
+TRANSIENT_ERRORS = {RATE_LIMITED, TIMEOUT, SERVER_ERROR}
+
+
+class CircuitOpenError(Exception):
+    """A dependency's circuit breaker is open; calls are rejected until it cools down"""
+
+    def __init__(self, dependency: str, retry_in: float):
+        super().__init__(f"{dependency} circuit open, retry in {retry_in:.0f}s")
+        self.dependency = dependency
+        self.retry_in = retry_in
+
+
+def classify_error(error: Exception) -> str:
+    """Map an exception to an error class"""
+    if isinstance(error, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if isinstance(error, QuotaWaitError):
+        return QUOTA_WAIT
+
+    if isinstance(error, openai.RateLimitError):
+        return RATE_LIMITED
+    if isinstance(error, openai.APITimeoutError):
+        return TIMEOUT
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return SERVER_ERROR
+    if isinstance(error, openai.APIStatusError):
+        return SERVER_ERROR if error.status_code >= 500 else FATAL
+
+    if isinstance(error, httpx.TimeoutException):
+        return TIMEOUT
+    if isinstance(error, httpx.TransportError):
+        return SERVER_ERROR
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status == 429:
+            return RATE_LIMITED
+        if status >= 500:
+            return SERVER_ERROR
+        return FATAL
+
+    if isinstance(error, requests.exceptions.Timeout):
+        return TIMEOUT
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return SERVER_ERROR
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        if status == 429:
+            return RATE_LIMITED
+        if status >= 500:
+            return SERVER_ERROR
+        return FATAL
+
+    if isinstance(error, TimeoutError):
+        return TIMEOUT
+    if isinstance(error, json.JSONDecodeError):
+        return PARSE_ERROR
+
+    return FATAL
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter: delay ~ U(base_delay / 2, min(max_delay, base_delay * 2^(attempt-1)))"""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        ceiling = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        return random.uniform(self.base_delay / 2, max(self.base_delay / 2, ceiling))
+
+
+def _policy_from_env(error_class: str, max_attempts: int, base_delay: float, max_delay: float) -> RetryPolicy:
+    prefix = f"RETRY_{error_class.upper()}"
+    return RetryPolicy(
+        max_attempts=int(os.getenv(f"{prefix}_MAX_ATTEMPTS", str(max_attempts))),
+        base_delay=float(os.getenv(f"{prefix}_BASE_DELAY", str(base_delay))),
+        max_delay=float(os.getenv(f"{prefix}_MAX_DELAY", str(max_delay)))
+    )
+
+
+class RetryPolicies:
+    """
+    Per-error-class retry policies (env-configurable, e.g. RETRY_RATE_LIMITED_MAX_ATTEMPTS)
+
+    Fatal errors (bad input, 4xx other than 429, bugs) are never retried.
+    Quota waits are retried once the quota frees up, however often, and
+    don't use up an attempt.
+    """
+
+    def __init__(self):
+        self.policies: Dict[str, RetryPolicy] = {
+            RATE_LIMITED: _policy_from_env(RATE_LIMITED, 6, 30, 900),
+            TIMEOUT: _policy_from_env(TIMEOUT, 4, 15, 300),
+            SERVER_ERROR: _policy_from_env(SERVER_ERROR, 4, 20, 600),
+            PARSE_ERROR: _policy_from_env(PARSE_ERROR, 2, 5, 60),
+            CIRCUIT_OPEN: _policy_from_env(CIRCUIT_OPEN, 8, 30, 900),
+        }
+
+    def retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Seconds to wait before the next attempt, or None if the job should fail
+
+        Args:
+            error: The exception that ended this attempt
+            attempt: The attempt that just failed (1-based)
+        """
+        error_class = classify_error(error)
+        if error_class == QUOTA_WAIT:
+            return error.retry_in
+
+        policy = self.policies.get(error_class)
+        if policy is None or attempt >= policy.max_attempts:
+            return None
+
+        delay = policy.delay(attempt)
+        if isinstance(error, CircuitOpenError):
+            # No point retrying before the breaker lets a probe through
+            delay = max(delay, error.retry_in)
+        return delay
+
+    def counts_as_attempt(self, error: Exception) -> bool:
+        """Whether the attempt that ended with this error counts towards max_attempts"""
+        return classify_error(error) != QUOTA_WAIT
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker
+
+    Opens after failure_threshold consecutive transient failures and rejects
+    calls for reset_timeout seconds; then lets a single probe call through
+    (half-open) and closes again on its success.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = None, reset_timeout: float = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+        self.reset_timeout = reset_timeout or float(os.getenv('CIRCUIT_RESET_TIMEOUT', '60'))
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if calls to the dependency are currently rejected"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            retry_in = self.opened_at + self.reset_timeout - time.time()
+            if retry_in > 0 or self.probing:
+                raise CircuitOpenError(self.name, max(retry_in, 1))
+
+            # Half-open: this caller is the probe
+            self.probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_inconclusive(self):
+        """The call neither proves nor disproves the dependency is healthy - let the next caller probe again"""
+        with self._lock:
+            self.probing = False
+
+    def record_failure(self, error: Exception):
+        """Count a failure; only transient errors (429, timeouts, 5xx) trip the breaker"""
+        if classify_error(error) not in TRANSIENT_ERRORS:
+            self.record_inconclusive()
+            return
+
+        with self._lock:
+
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures: {error}")
+                self.opened_at = time.time()
+                self.probing = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Process-wide circuit breaker for a dependency"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,167 @@
+"""
+Search Result Cache
+Caches Brave search results keyed by the normalized query and provider
+parameters, so re-assessments and repeated queries within a run cost no quota
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query"""
+    return ' '.join(query.lower().split())
+
+
+def make_search_cache_key(provider: str, query: str, params: Dict) -> str:
+    """Hash the provider, normalized query and every parameter that shapes the results"""
+    payload = json.dumps([provider, normalize_query(query), params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SearchResultCache:
+    """
+    Two-level search result cache with TTL
+
+    An in-process LRU (SEARCH_CACHE_LRU_SIZE entries) sits in front of the
+    search_result_cache table, which is shared by all workers.
+
+    Backends (SEARCH_CACHE_BACKEND):
+        postgres - LRU in front of Postgres (default; LRU only if no database)
+        memory   - in-process LRU only
+        off      - caching disabled
+    """
+
+    def __init__(self, db=None):
+        self.backend = os.getenv('SEARCH_CACHE_BACKEND', 'postgres').lower()
+        self.ttl_seconds = int(float(os.getenv('SEARCH_CACHE_TTL_HOURS', '168')) * 3600)
+        self.lru_size = int(os.getenv('SEARCH_CACHE_LRU_SIZE', '2000'))
+        self.evict_interval = int(os.getenv('SEARCH_CACHE_EVICT_INTERVAL', '600'))
+        self.db = db
+
+        if self.backend == 'postgres' and self.db is None:
+            logger.warning("Search cache backend 'postgres' requires a database, using in-process cache only")
+            self.backend = 'memory'
+
+        self._lru: OrderedDict = OrderedDict()  # cache_key -> (expires_at, results)
+        self._lock = threading.Lock()
+        self._last_evicted = 0.0
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+
+        logger.info(f"Search result cache: backend={self.backend}, ttl={self.ttl_seconds}s, "
+                    f"lru_size={self.lru_size}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend in ('postgres', 'memory')
+
+    def get(self, cache_key: str) -> Optional[List[Dict]]:
+        """Return cached results or None (cache failures are treated as misses)"""
+        if not self.enabled:
+            return None
+
+        results = self._lru_get(cache_key)
+        if results is not None:
+            self._count('memory_hits')
+            return results
+
+        if self.backend == 'postgres':
+            try:
+                entry = self.db.get_search_cache_entry(cache_key, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Search cache read failed: {e}")
+                self._count('errors')
+                entry = None
+
+            if entry is not None:
+                self._count('db_hits')
+                self._lru_set(cache_key, entry['results'], entry['age_seconds'])
+                return entry['results']
+
+        self._count('misses')
+        return None
+
+    def set(self, cache_key: str, query: str, results: List[Dict]):
+        """Store results (cache failures never fail the caller)"""
+        if not self.enabled:
+            return
+
+        self._lru_set(cache_key, results)
+        self._count('writes')
+
+        if self.backend == 'postgres':
+            try:
+                self.db.save_search_cache_entry(cache_key, query, results)
+                self._maybe_evict()
+            except Exception as e:
+                logger.warning(f"Search cache write failed: {e}")
+                self._count('errors')
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            hits = self.stats['memory_hits'] + self.stats['db_hits']
+            total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _lru_get(self, cache_key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._lru.get(cache_key)
+            if entry is None:
+                return None
+            expires_at, results = entry
+            if expires_at <= time.time():
+                del self._lru[cache_key]
+                return None
+            self._lru.move_to_end(cache_key)
+            return results
+
+    def _lru_set(self, cache_key: str, results: List[Dict], age_seconds: float = 0):
+        if self.lru_size <= 0:
+            return
+        with self._lock:
+            # Entries loaded from Postgres keep their original expiry
+            self._lru[cache_key] = (time.time() + self.ttl_seconds - age_seconds, results)
+            self._lru.move_to_end(cache_key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _maybe_evict(self):
+        """Delete expired rows, at most once per evict_interval per process"""
+        with self._lock:
+            now = time.time()
+            if now - self._last_evicted < self.evict_interval:
+                return
+            self._last_evicted = now
+
+        deleted = self.db.evict_search_cache(self.ttl_seconds)
+        if deleted:
+            logger.info(f"Evicted {deleted} expired search cache entries")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_search_cache(db=None) -> SearchResultCache:
+    """Process-wide search result cache (so the LRU is shared by all jobs in a worker)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SearchResultCache(db)
+        elif _cache.db is None and db is not None and _cache.backend == 'memory' \
+                and os.getenv('SEARCH_CACHE_BACKEND', 'postgres').lower() == 'postgres':
+            # Created before a database was available - attach it now
+            _cache.db = db
+            _cache.backend = 'postgres'
+        return _cache
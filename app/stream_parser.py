@@ -0,0 +1,162 @@
+"""
+Incremental Measure Parser for Streaming DeepSeek Responses
+Emits each "Mxx": {...} object from the batch JSON as soon as it closes
+"""
+import re
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MEASURES_OPEN_RE = re.compile(r'"measures"\s*:\s*\{')
+MEASURE_KEY_RE = re.compile(r'\s*,?\s*"(M\d{2})"\s*:\s*\{')
+MEASURES_CLOSE_RE = re.compile(r'\s*,?\s*\}')
+
+# Preamble allowed before the "measures" object starts (e.g. ```json, prose)
+MAX_PREAMBLE_CHARS = 2000
+
+
+class MeasureStreamParser:
+    """
+    Incremental parser for the batch output format:
+
+        {"measures": {"M01": {...}, "M02": {...}, ...}}
+
+    Feed text deltas with feed(). Completed measures are collected in
+    self.measures (and passed to on_measure). If the stream stops looking like
+    the expected format, self.malformed is set so the caller can cut it off.
+    """
+
+    def __init__(self, measure_ids: List[str],
+                 on_measure: Optional[Callable[[str, Dict], None]] = None):
+        self.measure_ids = set(measure_ids)
+        self.on_measure = on_measure
+        self.measures: Dict[str, Dict] = {}
+        self.malformed = False
+        self.error: Optional[str] = None
+        self.done = False
+
+        self._buffer = ''
+        self._pos = 0
+        self._in_measures = False
+
+        # Brace-matching state for the measure object currently being read
+        self._current_id: Optional[str] = None
+        self._object_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> List[str]:
+        """Consume a chunk of streamed text and return newly completed measure IDs"""
+        if self.malformed or self.done or not text:
+            return []
+
+        self._buffer += text
+        completed = []
+
+        while not self.malformed and not self.done:
+            if not self._in_measures:
+                if not self._find_measures_open():
+                    break
+            elif self._current_id is None:
+                if not self._find_next_key():
+                    break
+            elif not self._scan_object(completed):
+                break
+
+        return completed
+
+    def _fail(self, reason: str):
+        self.malformed = True
+        self.error = reason
+        logger.warning(f"Malformed measure stream: {reason}")
+
+    def _find_measures_open(self) -> bool:
+        match = MEASURES_OPEN_RE.search(self._buffer, self._pos)
+        if match:
+            self._in_measures = True
+            self._pos = match.end()
+            return True
+
+        if len(self._buffer) > MAX_PREAMBLE_CHARS:
+            self._fail('no "measures" object found')
+        return False
+
+    def _find_next_key(self) -> bool:
+        rest = self._buffer[self._pos:]
+        if not rest.strip(' \t\r\n,'):
+            return False  # Need more data
+
+        match = MEASURE_KEY_RE.match(self._buffer, self._pos)
+        if match:
+            self._current_id = match.group(1)
+            self._object_start = match.end() - 1
+            self._pos = match.end()
+            self._depth = 1
+            self._in_string = False
+            self._escape = False
+            return True
+
+        if MEASURES_CLOSE_RE.match(self._buffer, self._pos):
+            self.done = True
+            return False
+
+        # A partial key like '"M1' may still complete in the next chunk
+        if re.fullmatch(r'\s*,?\s*("M?\d{0,2}"?\s*:?\s*)?', rest):
+            return False
+
+        self._fail(f"unexpected content between measures: {rest[:40]!r}")
+        return False
+
+    def _scan_object(self, completed: List[str]) -> bool:
+        """Advance through the current object; return True once it has closed"""
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_object(i + 1, completed)
+                    return True
+            i += 1
+
+        self._pos = i
+        return False
+
+    def _complete_object(self, end: int, completed: List[str]):
+        measure_id = self._current_id
+        raw = self._buffer[self._object_start:end]
+        self._current_id = None
+        self._pos = end
+
+        try:
+            measure = json.loads(raw)
+        except json.JSONDecodeError as e:
+            self._fail(f"{measure_id} is not valid JSON: {e}")
+            return
+
+        if measure_id not in self.measure_ids:
+            logger.warning(f"Ignoring unexpected measure {measure_id} in stream")
+            return
+
+        self.measures[measure_id] = measure
+        completed.append(measure_id)
+        if self.on_measure:
+            try:
+                self.on_measure(measure_id, measure)
+            except Exception as e:
+                logger.warning(f"on_measure callback failed for {measure_id}: {e}")
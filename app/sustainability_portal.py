@@ -3,10 +3,11 @@ Sustainability Portal Integration
 Searches sustainability report databases and portals for company reports
 """
 import logging
-import requests
 from typing import List, Dict, Optional
 import os
 
+from app import http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -47,10 +48,11 @@ class SustainabilityPortalSearch:
         try:
             # Search CDP website for company responses
             query = f'site:cdp.net "{company_name}" climate change response'
-            response = requests.get(
+            response = http_client.get(
                 'https://api.search.brave.com/res/v1/web/search',
                 params={'q': query, 'count': 5},
-                headers={'X-Subscription-Token': self.brave_api_key}
+                headers={'X-Subscription-Token': self.brave_api_key},
+                timeout=10
             )
             
             results = response.json()
@@ -81,10 +83,11 @@ class SustainabilityPortalSearch:
         try:
             # Search GRI database
             query = f'site:database.globalreporting.org "{company_name}" sustainability report'
-            response = requests.get(
+            response = http_client.get(
                 'https://api.search.brave.com/res/v1/web/search',
                 params={'q': query, 'count': 5},
-                headers={'X-Subscription-Token': self.brave_api_key}
+                headers={'X-Subscription-Token': self.brave_api_key},
+                timeout=10
             )
             
             results = response.json()
@@ -127,10 +130,11 @@ class SustainabilityPortalSearch:
             
             for query in queries:
                 try:
-                    response = requests.get(
+                    response = http_client.get(
                         'https://api.search.brave.com/res/v1/web/search',
                         params={'q': query, 'count': 3},
-                        headers={'X-Subscription-Token': self.brave_api_key}
+                        headers={'X-Subscription-Token': self.brave_api_key},
+                        timeout=10
                     )
                     
                     results = response.json()
@@ -164,10 +168,11 @@ class SustainabilityPortalSearch:
         try:
             # Search SEC EDGAR for 10-K with climate mentions
             query = f'site:sec.gov "{company_name}" 10-K climate risk'
-            response = requests.get(
+            response = http_client.get(
                 'https://api.search.brave.com/res/v1/web/search',
                 params={'q': query, 'count': 3},
-                headers={'X-Subscription-Token': self.brave_api_key}
+                headers={'X-Subscription-Token': self.brave_api_key},
+                timeout=10
             )
             
             results = response.json()
@@ -6,13 +6,22 @@ Processes pending assessment jobs in parallel using DeepSeek V3
 import os
 import sys
 import time
+import signal
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Add app to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app.database import Database, init_database
-from app.assessment_engine_batched import BatchedAssessmentEngine
+from app.database import (
+    Database, JobNotificationListener, init_database,
+    LANE_BULK, LANE_INTERACTIVE, STAGE_RETRIEVAL, STAGE_ASSESSMENT
+)
+from app.assessment_engine_batched import (
+    BatchedAssessmentEngine, JobInterrupted, JobRetryScheduled, LeaseLostError, MEASURE_BATCHES
+)
+from app.http_client import close_http_client
 
 # Configure logging
 logging.basicConfig(
@@ -21,6 +30,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class StagePool:
+    """Concurrency slots, local prefetch queue and in-flight jobs for one pipeline stage"""
+    
+    def __init__(self, stage, concurrency: int):
+        self.stage = stage  # None runs the whole pipeline per job
+        self.name = stage or 'pipeline'
+        self.concurrency = concurrency
+        self.queue = deque()
+        self.in_flight = set()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=self.name)
+    
+    @property
+    def free_slots(self) -> int:
+        return self.concurrency - len(self.in_flight)
+
 class AssessmentWorker:
     """Background worker that processes assessment jobs from the queue"""
     
@@ -31,20 +55,72 @@ class AssessmentWorker:
         except Exception as e:
             logger.warning(f"Database initialization: {e}")
         
+        # One DB pool, HTTP session and DeepSeek client shared by all job threads
         self.db = Database()
         self.engine = BatchedAssessmentEngine()
         self.running = True
         self.worker_id = os.getenv('DYNO', 'worker')
-        logger.info(f"[{self.worker_id}] Batched assessment worker initialized (DeepSeek V3)")
+        
+        # Jobs in the assessment (LLM) stage processed at once (jobs are I/O-bound)
+        self.concurrency = max(1, int(os.getenv('WORKER_CONCURRENCY', '5')))
+        
+        # Jobs in the retrieval (Brave search) stage processed at once; retrieval
+        # for the next companies overlaps with LLM calls for earlier ones.
+        # 0 runs search and assessment back-to-back in one slot per job.
+        self.retrieval_concurrency = max(0, int(os.getenv('RETRIEVAL_CONCURRENCY', '2')))
+        if self.retrieval_concurrency:
+            self.pools = [
+                StagePool(STAGE_RETRIEVAL, self.retrieval_concurrency),
+                StagePool(STAGE_ASSESSMENT, self.concurrency)
+            ]
+        else:
+            self.pools = [StagePool(None, self.concurrency)]
+        
+        # Extra jobs claimed ahead into each local queue, so claims happen in batches
+        self.prefetch = max(0, int(os.getenv('WORKER_PREFETCH', '0')))
+        
+        # Every n-th claim prefers the bulk lane so bulk progresses under interactive load
+        self.bulk_claim_every = max(1, int(os.getenv('BULK_CLAIM_EVERY', '4')))
+        self.claim_count = 0
+        
+        # Jobs are dispatched via LISTEN/NOTIFY; this is only the fallback poll
+        self.poll_interval = float(os.getenv('JOB_POLL_INTERVAL', '60'))
+        self.listener = JobNotificationListener()
+        
+        # Stale-job reaper: jobs whose lease expired (e.g. worker restarted mid-job)
+        # go back to pending, or fail once they have used up their attempts
+        self.reap_interval = float(os.getenv('REAPER_INTERVAL', '60'))
+        self.max_attempts = max(1, int(os.getenv('JOB_MAX_ATTEMPTS', '3')))
+        self.last_reap = 0.0
+        
+        # Liveness registry for /api/queue/metrics (live workers, capacity)
+        self.heartbeat_interval = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '30'))
+        self.last_heartbeat = 0.0
+        self.registry_id = f"{self.worker_id}:{os.getpid()}"
+        
+        # Shutdown (SIGTERM): in-flight jobs get this long to finish on their own before
+        # their streams are cut off, progress checkpointed and the jobs released.
+        # Heroku sends SIGKILL 30s after SIGTERM.
+        self.shutdown_grace = float(os.getenv('SHUTDOWN_GRACE_SECONDS', '20'))
+        self.shutdown_abort_timeout = float(os.getenv('SHUTDOWN_ABORT_SECONDS', '8'))
+        
+        stages = ', '.join(f"{pool.name}={pool.concurrency}" for pool in self.pools)
+        logger.info(f"[{self.worker_id}] Batched assessment worker initialized (DeepSeek V3, "
+                    f"concurrency: {stages})")
     
-    def process_job(self, job):
-        """Process a single assessment job"""
+    def process_job(self, job, stage=None) -> bool:
+        """Process a single assessment job (one stage of it, or the whole pipeline if stage is None)"""
         job_id = job['id']
         company_name = job['company']
         isin = job['isin']
         
         try:
-            logger.info(f"[{self.worker_id}] Processing Job #{job_id}: {company_name} ({isin})")
+            logger.info(f"[{self.worker_id}] Processing Job #{job_id} ({stage or 'pipeline'}): "
+                        f"{company_name} ({isin})")
+            
+            if job.get('prefetched') and job.get('stage') != STAGE_ASSESSMENT:
+                # Waited in the local queue - restart the clock for duration metrics
+                self.db.update_job_status(job_id, 'processing', claim_token=job['claim_token'])
             
             # Prepare company data
             company_data = {
@@ -53,9 +129,17 @@ class AssessmentWorker:
                 'isin': isin,
                 'sector': job.get('sector'),
                 'industry': job.get('industry'),
-                'country': job.get('country')
+                'country': job.get('country'),
+                'bypass_llm_cache': job.get('bypass_llm_cache', False),
+                'attempts': job.get('attempts') or 1,
+                'claim_token': job['claim_token']
             }
             
+            if stage == STAGE_RETRIEVAL:
+                self.engine.run_retrieval(job_id=job_id, company_data=company_data)
+                logger.info(f"[{self.worker_id}] ✓ Retrieved Job #{job_id}: {company_name}")
+                return True
+            
             # Run assessment
             self.engine.process_company(
                 job_id=job_id,
@@ -65,42 +149,170 @@ class AssessmentWorker:
             logger.info(f"[{self.worker_id}] ✓ Completed Job #{job_id}: {company_name}")
             return True
             
+        except LeaseLostError as e:
+            # Not a failure of this worker - the job was requeued and is someone else's now
+            logger.warning(f"[{self.worker_id}] Dropped Job #{job_id}: {e}")
+            return True
+            
+        except JobInterrupted as e:
+            logger.warning(f"[{self.worker_id}] ⏸ Released Job #{job_id} on shutdown: {e}")
+            return True
+            
+        except JobRetryScheduled as e:
+            logger.warning(f"[{self.worker_id}] ↻ Requeued Job #{job_id}: {e}")
+            return True
+            
         except Exception as e:
             logger.error(f"[{self.worker_id}] ✗ Failed Job #{job_id}: {str(e)}", exc_info=True)
             return False
     
+    def maintain_leases(self):
+        """Extend leases of prefetched and running jobs and reap expired ones (every reap_interval)"""
+        if time.time() - self.last_reap < self.reap_interval:
+            return
+        self.last_reap = time.time()
+        
+        for pool in self.pools:
+            running = [future.job for future in pool.in_flight if not future.done()]
+            claims = {job['id']: job['claim_token'] for job in list(pool.queue) + running}
+            if not claims:
+                continue
+            held = set(self.db.extend_job_leases(claims))
+            # Drop queued jobs that were reaped while waiting here
+            pool.queue = deque(job for job in pool.queue if job['id'] in held)
+            # Running ones notice at their next stage heartbeat and abandon the job
+            lost = [job['id'] for job in running if job['id'] not in held]
+            if lost:
+                logger.warning(f"[{self.worker_id}] Lost leases of running job(s) {lost}")
+        
+        reaped = self.db.reap_expired_jobs(self.max_attempts)
+        if reaped['requeued']:
+            logger.warning(f"[{self.worker_id}] Requeued jobs with expired leases: {reaped['requeued']}")
+        if reaped['failed']:
+            logger.error(f"[{self.worker_id}] Failed jobs out of attempts: {reaped['failed']}")
+    
+    def send_heartbeat(self):
+        """Report this worker as alive with its capacity and load (every heartbeat_interval)"""
+        if time.time() - self.last_heartbeat < self.heartbeat_interval:
+            return
+        self.last_heartbeat = time.time()
+        
+        try:
+            self.db.record_worker_heartbeat(
+                self.registry_id,
+                concurrency=sum(pool.concurrency for pool in self.pools),
+                in_flight=sum(len(pool.in_flight) for pool in self.pools)
+            )
+        except Exception as e:
+            logger.warning(f"[{self.worker_id}] Worker heartbeat failed: {e}")
+    
+    def fill_pool(self, pool: StagePool):
+        """Claim jobs for a stage when its local queue can't fill the free slots, then start them"""
+        if pool.free_slots > 0 and len(pool.queue) < pool.free_slots:
+            claim = pool.free_slots + self.prefetch - len(pool.queue)
+            self.claim_count += 1
+            lane = LANE_BULK if self.claim_count % self.bulk_claim_every == 0 else LANE_INTERACTIVE
+            pending_jobs = self.db.get_pending_jobs(limit=claim, preferred_lane=lane, stage=pool.stage)
+            if pending_jobs:
+                logger.info(f"[{self.worker_id}] Claimed {len(pending_jobs)} {pool.name} job(s)")
+            pool.queue.extend(pending_jobs)
+        
+        # Start queued jobs in the free slots
+        while pool.queue and pool.free_slots > 0:
+            job = pool.queue.popleft()
+            future = pool.executor.submit(self.process_job, job, pool.stage)
+            future.job = job
+            # A finished job frees a slot - wake the loop to start the next one
+            future.add_done_callback(lambda _: self.listener.wake())
+            pool.in_flight.add(future)
+        
+        # Mark the rest as prefetched (started_at is reset when they start)
+        for job in pool.queue:
+            job['prefetched'] = True
+    
+    def release_queued_jobs(self):
+        """Hand prefetched jobs back to the shared queue"""
+        claims = {job['id']: job['claim_token'] for pool in self.pools for job in pool.queue}
+        for pool in self.pools:
+            pool.queue.clear()
+        if not claims:
+            return
+        try:
+            released = self.db.release_jobs(claims)
+            logger.info(f"[{self.worker_id}] Released {released} prefetched job(s) back to the queue")
+        except Exception as e:
+            logger.error(f"[{self.worker_id}] Failed to release prefetched jobs {list(claims)}: {e}")
+    
+    def request_shutdown(self, signum, frame):
+        """Signal handler: stop claiming and let run() drain in-flight jobs"""
+        if not self.running:
+            return
+        logger.info(f"[{self.worker_id}] Received {signal.Signals(signum).name}, draining...")
+        self.running = False
+        self.listener.wake()
+    
+    def drain(self):
+        """Finish, or checkpoint and release, in-flight jobs within the shutdown grace period"""
+        in_flight = {future for pool in self.pools for future in pool.in_flight}
+        if not in_flight:
+            return
+        
+        logger.info(f"[{self.worker_id}] Waiting up to {self.shutdown_grace:.0f}s for "
+                    f"{len(in_flight)} in-flight job(s) to finish...")
+        _, in_flight = wait(in_flight, timeout=self.shutdown_grace)
+        if not in_flight:
+            return
+        
+        # Out of time: cut off LLM streams; batches checkpoint what finished and release their jobs
+        logger.warning(f"[{self.worker_id}] Interrupting {len(in_flight)} job(s)")
+        self.engine.stop_event.set()
+        _, in_flight = wait(in_flight, timeout=self.shutdown_abort_timeout)
+        
+        # Still stuck (e.g. mid-search): release them directly, completed stages stay checkpointed
+        stuck = {future.job['id']: future.job['claim_token'] for future in in_flight}
+        if stuck:
+            try:
+                self.db.release_jobs(stuck)
+                logger.warning(f"[{self.worker_id}] Released stuck job(s) {list(stuck)}")
+            except Exception as e:
+                logger.error(f"[{self.worker_id}] Failed to release stuck jobs {list(stuck)}: {e}")
+    
     def run(self):
         """Main worker loop"""
         logger.info("=" * 60)
         logger.info(f"[{self.worker_id}] Climate Risk Assessment Worker Started")
-        logger.info(f"[{self.worker_id}] Using Batched DeepSeek V3 (5 batches per company)")
+        if self.engine.batch_planning == 'fixed':
+            batching = f"{len(MEASURE_BATCHES)} fixed batches per company"
+        else:
+            batching = "token-budgeted batches planned per company"
+        logger.info(f"[{self.worker_id}] Using Batched DeepSeek V3 ({batching})")
         logger.info(f"[{self.worker_id}] Comprehensive detail: 44 measures with full rationale & evidence")
         logger.info("=" * 60)
         
         consecutive_errors = 0
         max_consecutive_errors = 5
         
+        signal.signal(signal.SIGTERM, self.request_shutdown)
+        signal.signal(signal.SIGINT, self.request_shutdown)
+        
         while self.running:
             try:
-                # Get pending jobs (one at a time per worker)
-                logger.info(f"[{self.worker_id}] Checking for pending jobs...")
-                pending_jobs = self.db.get_pending_jobs(limit=1)
-                logger.info(f"[{self.worker_id}] Found {len(pending_jobs)} pending job(s)")
+                # Collect finished jobs (job failures are the retry policy's concern,
+                # they never stop the worker)
+                for pool in self.pools:
+                    pool.in_flight = {future for future in pool.in_flight if not future.done()}
+                
+                self.maintain_leases()
                 
-                if pending_jobs:
-                    for job in pending_jobs:
-                        success = self.process_job(job)
-                        
-                        if success:
-                            consecutive_errors = 0
-                        else:
-                            consecutive_errors += 1
-                        
-                        # Brief pause between jobs
-                        time.sleep(2)
-                else:
-                    # No pending jobs, wait before checking again
-                    time.sleep(10)
+                for pool in self.pools:
+                    self.fill_pool(pool)
+                
+                self.send_heartbeat()
+                
+                # Queues are drained or all slots are busy: sleep until a job is created
+                # or changes stage (NOTIFY), a local job finishes, or the fallback poll is due
+                self.listener.wait(min(self.poll_interval, self.reap_interval, self.heartbeat_interval))
+                consecutive_errors = 0
                 
             except KeyboardInterrupt:
                 logger.info(f"[{self.worker_id}] Received shutdown signal, stopping...")
@@ -115,10 +327,30 @@ class AssessmentWorker:
                     logger.critical(f"[{self.worker_id}] Too many consecutive errors, stopping")
                     break
                 
-                # Wait before retrying
-                time.sleep(30)
+                # Wait before retrying (returns early on shutdown)
+                self.listener.wait(30)
+        
+        self.release_queued_jobs()
+        self.drain()
         
+        for pool in self.pools:
+            # Threads still stuck after drain() hold released jobs; don't wait for them
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+        
+        try:
+            self.db.remove_worker_heartbeat(self.registry_id)
+        except Exception as e:
+            logger.warning(f"[{self.worker_id}] Failed to deregister worker: {e}")
+        
+        self.listener.close()
         logger.info(f"[{self.worker_id}] Worker stopped")
+        
+        if any(future.running() for pool in self.pools for future in pool.in_flight):
+            # Don't let interpreter exit block on abandoned threads until SIGKILL
+            logging.shutdown()
+            os._exit(0)
+        
+        close_http_client()
 
 def main():
     """Entry point for worker"""